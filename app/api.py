@@ -1,22 +1,61 @@
 import argparse
 import base64
+import ipaddress
 import secrets
 import urllib.parse
 
 import requests
-from flask import Flask, request, redirect, make_response
+from flask import Flask, request, redirect, make_response, jsonify
 
+from app.auth import TokenManager
+from app.caching import (
+    DEFAULT_CACHE_MAX_ENTRIES,
+    DEFAULT_CACHE_PATH,
+    DEFAULT_CACHE_TTL,
+    song_search_cache,
+)
+from app.catalog_index import local_catalog
+from app.cli import positive_int
+from app.http_session import configure_http_session
+from app.jobs import (
+    DEFAULT_JOB_CONCURRENCY,
+    DEFAULT_JOB_WORKERS,
+    DEFAULT_MAX_QUEUED_JOBS,
+    JobManager,
+    QueueFullError,
+    validate_job_params,
+)
+from app.metrics import metrics
 
-def create_app(client_id, client_secret, redirect_uri="http://localhost:8888/callback"):
+
+def is_loopback_request():
+    """
+    Returns True if the current request came from this machine.
+    """
+    try:
+        return ipaddress.ip_address(request.remote_addr or "").is_loopback
+    except ValueError:
+        return False
+
+
+def create_app(
+    client_id,
+    client_secret,
+    redirect_uri="http://localhost:8888/callback",
+    job_manager=None,
+):
     """
     Create a Flask app with the given Spotify credentials.
 
     :param client_id: Spotify Client ID (required)
     :param client_secret: Spotify Client Secret (required)
     :param redirect_uri: Redirect URI (default: http://localhost:8888/callback)
+    :param job_manager: JobManager running /jobs requests (default: a new one)
     :return: Configured Flask application
     """
     app = Flask(__name__)
+    if job_manager is None:
+        job_manager = JobManager()
 
     # Spotify config
     SCOPE = (
@@ -29,8 +68,9 @@ def create_app(client_id, client_secret, redirect_uri="http://localhost:8888/cal
     )
     STATE_KEY = "spotify_auth_state"
 
-    # Token storage for demo (not secure for production)
-    tokens = {}
+    # Token storage for demo (not secure for production). Refreshed ahead of
+    # expiry, for /token and for local jobs submitted without their own token.
+    tokens = TokenManager(client_id=client_id, client_secret=client_secret)
 
     def generate_random_string(length=16):
         """Generate a random string for the state parameter."""
@@ -87,10 +127,10 @@ def create_app(client_id, client_secret, redirect_uri="http://localhost:8888/cal
 
     @app.route("/")
     def home():
-        if not tokens:
+        if not tokens.access_token:
             return "No tokens available. Please <a href='/login'>login</a> first."
-        access_token = tokens.get("access_token")
-        refresh_token = tokens.get("refresh_token")
+        access_token = tokens.access_token
+        refresh_token = tokens.refresh_token
         return f"""
         <html>
         <body>
@@ -110,6 +150,64 @@ def create_app(client_id, client_secret, redirect_uri="http://localhost:8888/cal
         </html>
         """
 
+    @app.route("/metrics")
+    def metrics_endpoint():
+        # Prometheus text format by default, ?format=json for the summary
+        if request.args.get("format") == "json":
+            return jsonify(metrics.summary())
+        return (
+            metrics.render_prometheus(),
+            200,
+            {"Content-Type": "text/plain; version=0.0.4"},
+        )
+
+    @app.route("/token")
+    def token():
+        # Token broker for long CLI and batch runs (see --token-url). It
+        # hands out the account's token, so only to callers on this machine.
+        if not is_loopback_request():
+            return jsonify({"error": "/token is only served locally."}), 403
+        if not tokens.access_token:
+            return jsonify({"error": "No tokens available, log in at /login."}), 404
+        return jsonify(
+            {"access_token": tokens.get(), "expires_in": tokens.seconds_left()}
+        )
+
+    @app.route("/jobs", methods=["POST"])
+    def submit_job():
+        params = request.get_json(silent=True)
+        if isinstance(params, dict) and not params.get("access_token"):
+            # Fall back to the bearer token, then to the one from /login,
+            # which only the owner of the account, on this machine, may use
+            authorization = request.headers.get("Authorization", "")
+            if authorization.startswith("Bearer "):
+                params["access_token"] = authorization[len("Bearer ") :]
+            elif tokens.access_token and is_loopback_request():
+                # Jobs can outlive the token, so hand them the manager itself
+                params["access_token"] = tokens
+
+        error = validate_job_params(params)
+        if error:
+            return jsonify({"error": error}), 400
+
+        try:
+            job = job_manager.submit(params)
+        except QueueFullError as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+
+        return jsonify(job.to_dict()), 202, {"Location": f"/jobs/{job.id}"}
+
+    @app.route("/jobs")
+    def list_jobs():
+        return jsonify([job.to_dict() for job in job_manager.list()])
+
+    @app.route("/jobs/<job_id>")
+    def get_job(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({"error": f"No job with ID {job_id}"}), 404
+        return jsonify(job.to_dict())
+
     @app.route("/favicon.ico")
     def favicon():
         return "", 204
@@ -130,11 +228,79 @@ if __name__ == "__main__":
         default="http://localhost:8888/callback",
         help="Spotify Redirect URI (default: http://localhost:8888/callback)",
     )
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=DEFAULT_JOB_WORKERS,
+        help=f"Jobs to run at once (default: {DEFAULT_JOB_WORKERS})",
+    )
+    parser.add_argument(
+        "--max-queued-jobs",
+        type=int,
+        default=DEFAULT_MAX_QUEUED_JOBS,
+        help=f"Reject new jobs once this many are waiting (default: {DEFAULT_MAX_QUEUED_JOBS})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default=DEFAULT_JOB_CONCURRENCY,
+        help=(
+            "Concurrent searches across all running jobs "
+            f"(default: {DEFAULT_JOB_CONCURRENCY})"
+        ),
+    )
+    parser.add_argument(
+        "--http-pool-size",
+        type=positive_int,
+        help=(
+            "Connections kept open to the Spotify API "
+            "(default: one per concurrent search, see --concurrency)"
+        ),
+    )
+    parser.add_argument(
+        "--cache-path",
+        default=DEFAULT_CACHE_PATH,
+        help=f"SQLite file for the persistent search cache (default: {DEFAULT_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--no-persistent-cache",
+        action="store_true",
+        help="Keep the search cache in memory only",
+    )
+    parser.add_argument(
+        "--catalog-index",
+        help="Look titles up in this local catalog index before searching Spotify",
+    )
     args = parser.parse_args()
 
+    # Every job gets at least one search at a time
+    configure_http_session(
+        pool_size=args.http_pool_size,
+        concurrent_requests=max(args.concurrency, args.workers),
+    )
+    song_search_cache.configure(
+        path=None if args.no_persistent_cache else args.cache_path,
+        ttl=DEFAULT_CACHE_TTL,
+        max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+    )
+    local_catalog.configure(args.catalog_index)
+
+    job_manager = JobManager(
+        max_workers=args.workers,
+        max_queued=args.max_queued_jobs,
+        concurrency=args.concurrency,
+    )
     app = create_app(
         client_id=args.client_id,
         client_secret=args.client_secret,
         redirect_uri=args.redirect_uri,
+        job_manager=job_manager,
     )
-    app.run(port=8888, debug=True)
+    try:
+        # The reloader would start a second process with its own cache and
+        # jobs. Only listen locally: /login's tokens give access to the
+        # account.
+        app.run(host="127.0.0.1", port=8888, debug=True, use_reloader=False)
+    finally:
+        # Don't keep the server alive to run jobs nobody will collect
+        job_manager.shutdown()
@@ -0,0 +1,194 @@
+import base64
+import logging
+import threading
+import time
+
+import requests
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+# Refresh this long before the token expires, so no request is sent with a
+# token that expires on the way
+REFRESH_MARGIN = 5 * 60  # seconds
+# How long Spotify's tokens last, assumed when a token response doesn't say
+DEFAULT_TOKEN_LIFETIME = 60 * 60  # seconds
+TOKEN_REQUEST_TIMEOUT = 30  # seconds
+# After a failed refresh, wait this long before trying again, handing out
+# the current token meanwhile, so every request doesn't wait on a refresh
+REFRESH_RETRY_DELAY = 30  # seconds
+
+
+class TokenManager:
+    """
+    Hands out a valid Spotify access token for long runs, refreshing it
+    ahead of expiry (and whenever the API rejects it).
+
+    A new token comes either from Spotify, using the refresh token and the
+    app's client credentials, or from a token broker: the API server's
+    /token endpoint, which does the refreshing on our behalf.
+
+    Safe to share between threads; concurrent refreshes of the same stale
+    token only hit the token endpoint once.
+    """
+
+    def __init__(
+        self,
+        access_token=None,
+        refresh_token=None,
+        client_id=None,
+        client_secret=None,
+        expires_in=None,
+        broker_url=None,
+    ):
+        self._lock = threading.Lock()
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.broker_url = broker_url
+        self._refresh_failed_at = None
+        # None when we don't know, e.g. for a token passed on the command
+        # line; if we can refresh it, it's then replaced on first use
+        self.expires_at = time.time() + expires_in if expires_in is not None else None
+
+    @property
+    def can_refresh(self):
+        return bool(
+            self.broker_url
+            or (self.refresh_token and self.client_id and self.client_secret)
+        )
+
+    def seconds_left(self):
+        """
+        Returns the seconds until the current token expires, or None if unknown.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0, int(self.expires_at - time.time()))
+
+    def get(self):
+        """
+        Returns the current access token, refreshing it first if it is
+        missing or about to expire.
+        """
+        with self._lock:
+            if self.access_token and not self._expires_soon():
+                return self.access_token
+            stale_token = self.access_token
+        return self.refresh(stale_token)
+
+    def refresh(self, stale_token=None):
+        """
+        Gets a new access token to replace `stale_token` and returns it.
+        If another thread already replaced it, returns that token instead.
+        Returns the old token (or None) if it can't be refreshed, or if the
+        last refresh failed less than REFRESH_RETRY_DELAY seconds ago.
+        """
+        with self._lock:
+            if self.access_token != stale_token and not self._expires_soon():
+                return self.access_token
+            if (
+                self._refresh_failed_at is not None
+                and time.time() - self._refresh_failed_at < REFRESH_RETRY_DELAY
+            ):
+                return self.access_token
+            if not self.can_refresh:
+                if stale_token is not None:
+                    logger.warning(
+                        "Access token expired or rejected, and no refresh token "
+                        "or token broker was given to get a new one."
+                    )
+                return self.access_token
+
+            token_response = self._request_token()
+            if token_response:
+                self._update(token_response)
+                metrics.increment("token_refreshes")
+                logger.info(
+                    f"Refreshed the access token, valid for {self.seconds_left()}s."
+                )
+            else:
+                self._refresh_failed_at = time.time()
+                logger.warning(
+                    "Using the current access token, retrying the refresh "
+                    f"in {REFRESH_RETRY_DELAY}s."
+                )
+            return self.access_token
+
+    def update(self, token_response):
+        """
+        Stores the tokens from a Spotify token endpoint response.
+        """
+        with self._lock:
+            self._update(token_response)
+
+    def _update(self, token_response):
+        self._refresh_failed_at = None
+        self.access_token = token_response["access_token"]
+        # Spotify only sometimes rotates the refresh token
+        self.refresh_token = token_response.get("refresh_token", self.refresh_token)
+        expires_in = token_response.get("expires_in")
+        if expires_in is None:
+            expires_in = DEFAULT_TOKEN_LIFETIME
+        self.expires_at = time.time() + expires_in
+
+    def _expires_soon(self):
+        if self.expires_at is None:
+            # A token of unknown age may expire any time; only keep using
+            # it if there is no way to get a new one
+            return self.can_refresh
+        return self.expires_at - time.time() < REFRESH_MARGIN
+
+    def _request_token(self):
+        try:
+            if self.broker_url:
+                r = requests.get(self.broker_url, timeout=TOKEN_REQUEST_TIMEOUT)
+            else:
+                credentials = f"{self.client_id}:{self.client_secret}"
+                r = requests.post(
+                    SPOTIFY_TOKEN_URL,
+                    data={
+                        "grant_type": "refresh_token",
+                        "refresh_token": self.refresh_token,
+                    },
+                    headers={
+                        "Content-Type": "application/x-www-form-urlencoded",
+                        "Authorization": "Basic "
+                        + base64.b64encode(credentials.encode()).decode(),
+                    },
+                    timeout=TOKEN_REQUEST_TIMEOUT,
+                )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Access token refresh failed: {e}")
+            return None
+
+        if r.status_code != 200:
+            logger.error(f"Access token refresh failed: {r.status_code}, {r.text}")
+            return None
+        return r.json()
+
+
+def resolve_access_token(access_token):
+    """
+    Returns the token string for either a plain token or a TokenManager.
+    """
+    if isinstance(access_token, TokenManager):
+        return access_token.get()
+    return access_token
+
+
+def token_manager_from_args(args):
+    """
+    Builds a TokenManager from the --access-token, --refresh-token,
+    --client-id, --client-secret and --token-url arguments.
+    """
+    return TokenManager(
+        access_token=args.access_token,
+        refresh_token=args.refresh_token,
+        client_id=args.client_id,
+        client_secret=args.client_secret,
+        broker_url=args.token_url,
+    )
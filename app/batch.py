@@ -0,0 +1,161 @@
+import atexit
+import json
+import logging
+import sys
+
+from app.auth import token_manager_from_args
+from app.caching import song_search_cache
+from app.catalog_index import local_catalog
+from app.cli import parse_batch_arguments
+from app.http_session import configure_http_session
+from app.jobs import validate_job_params
+from app.metrics import report_metrics_summary
+from app.pipeline import JobError, find_best_playlist
+from app.scoring import get_scorer
+from app.spotify_api import add_tracks_to_playlist, create_playlist, get_user_id
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def run_job(job, access_token, scorer, args, user_id=None):
+    """
+    Runs a single batch job and returns its result as a dict.
+    """
+    # Checked like API jobs, but the token comes from the command line
+    error = validate_job_params(job, require_access_token=False)
+    if error:
+        raise JobError(error)
+
+    search_string = job["search_string"]
+    playlist_name = job.get("playlist_name")
+    playlist_id = job.get("playlist_id")
+    max_words = job.get("max_words", args.max_words)
+
+    if not playlist_name and not playlist_id and not args.dry_run:
+        raise JobError("One of 'playlist_name' or 'playlist_id' is required.")
+
+    tracks = find_best_playlist(
+        search_string,
+        access_token,
+        max_words,
+        scorer,
+        max_results=args.max_search_results,
+        concurrency=args.concurrency,
+        sentence_concurrency=args.sentence_concurrency,
+    )
+    result = {
+        "status": "ok",
+        "score": scorer.score(tracks),
+        "tracks": [track.to_dict() for track in tracks],
+    }
+
+    if args.dry_run:
+        return result
+
+    if playlist_id is None:
+        created_playlist = create_playlist(access_token, playlist_name, user_id=user_id)
+        if not created_playlist:
+            raise JobError("Playlist creation failed.")
+        playlist_id = created_playlist["id"]
+
+    if not add_tracks_to_playlist(access_token, playlist_id, tracks):
+        raise JobError(f"Adding tracks to playlist {playlist_id} failed.")
+
+    result["playlist_id"] = playlist_id
+    return result
+
+
+def run_batch(input_file, output_file, access_token, scorer, args, user_id=None):
+    """
+    Runs every job in `input_file` (JSONL) in order, writing one JSON result
+    per job to `output_file` as soon as it finishes. All jobs share the
+    search cache, so phrases are only searched once per batch.
+    Returns the number of jobs that failed.
+    """
+    failed = 0
+
+    for line_number, line in enumerate(input_file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        job = {}
+        try:
+            job = json.loads(line)
+            result = run_job(job, access_token, scorer, args, user_id=user_id)
+        except json.JSONDecodeError as e:
+            result = {"status": "error", "error": f"Invalid JSON: {e}"}
+        except JobError as e:
+            result = {"status": "error", "error": str(e)}
+        except Exception as e:
+            logger.exception(f"Job on line {line_number} failed unexpectedly.")
+            result = {"status": "error", "error": repr(e)}
+
+        if result["status"] != "ok":
+            failed += 1
+
+        job_id = job.get("id") if isinstance(job, dict) else None
+        result = {"line": line_number, "id": job_id, **result}
+        output_file.write(json.dumps(result) + "\n")
+        output_file.flush()
+
+        logger.info(
+            f"Job on line {line_number}: {result['status']} "
+            f"[{len(song_search_cache)} cached searches]"
+        )
+
+    return failed
+
+
+def main():
+    args = parse_batch_arguments()
+    # Refreshed as needed, so long batches outlive the hour a token lasts
+    access_token = token_manager_from_args(args)
+    scorer = get_scorer(args.score)
+
+    # Runs however the run ends, including sys.exit and Ctrl-C
+    atexit.register(report_metrics_summary, args.metrics_output)
+
+    # Each sentence runs its own searches at once
+    configure_http_session(
+        pool_size=args.http_pool_size,
+        concurrent_requests=args.concurrency * args.sentence_concurrency,
+    )
+    song_search_cache.configure(
+        path=None if args.no_persistent_cache else args.cache_path,
+        ttl=args.cache_ttl,
+        max_entries=args.cache_max_entries,
+    )
+    local_catalog.configure(args.catalog_index)
+
+    # Look the user up once rather than for every created playlist
+    user_id = None if args.dry_run else get_user_id(access_token)
+
+    with open(args.input) as input_file:
+        if args.output == "-":
+            failed = run_batch(
+                input_file, sys.stdout, access_token, scorer, args, user_id=user_id
+            )
+        else:
+            with open(args.output, "a") as output_file:
+                failed = run_batch(
+                    input_file,
+                    output_file,
+                    access_token,
+                    scorer,
+                    args,
+                    user_id=user_id,
+                )
+
+    if failed:
+        logger.warning(f"{failed} job(s) failed.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
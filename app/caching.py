@@ -1 +1,221 @@
-song_search_cache = {}
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.normalize import canonical_phrase
+from app.tracks import track_from_row
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "spotty", "search_cache.sqlite3"
+)
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60  # one week, in seconds
+DEFAULT_CACHE_MAX_ENTRIES = 100_000
+
+# Bump whenever the shape of the cached track lists or of the keys changes
+CACHE_SCHEMA_VERSION = 3
+
+
+class SearchCache:
+    """
+    Cache of track search results, keyed by canonical phrase (see
+    `canonical_phrase`), market and max_results.
+
+    Lookups are served from an in-process layer first. If a path has been
+    configured, results are also persisted to a SQLite database that can be
+    shared by several processes (WAL mode, busy timeout). Both layers apply
+    the TTL and evict the least recently used entries once they hold more
+    than `max_entries`.
+    """
+
+    def __init__(self):
+        # key -> (stored_at, tracks), least recently used first
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._path = None
+        self._ttl = DEFAULT_CACHE_TTL
+        self._max_entries = DEFAULT_CACHE_MAX_ENTRIES
+        self._local = threading.local()
+
+    def configure(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        ttl=DEFAULT_CACHE_TTL,
+        max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+    ):
+        """
+        Enables the on-disk cache at `path` (or disables it if `path` is None).
+        """
+        self._path = path
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._local = threading.local()
+
+        if path is None:
+            return
+
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._create_schema(self._connection())
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(
+                f"Unable to open search cache at {path} ({e}), using memory only."
+            )
+            self._path = None
+            return
+
+        logger.info(f"Using persistent search cache at {path}")
+
+    @staticmethod
+    def make_key(phrase, market, max_results):
+        return f"{market}|{max_results}|{canonical_phrase(phrase)}"
+
+    def get(self, phrase, market, max_results):
+        """
+        Returns the cached tracks for the phrase, or None on a miss.
+        """
+        key = self.make_key(phrase, market, max_results)
+        tracks = self._memory_get(key)
+        if tracks is not None or self._path is None:
+            return tracks
+
+        try:
+            entry = self._load(key)
+        except sqlite3.Error as e:
+            logger.warning(f"Search cache read failed: {e}")
+            return None
+
+        if entry is None:
+            return None
+        stored_at, tracks = entry
+        # Keeps the time it was searched, so it expires from both layers
+        self._memory_set(key, stored_at, tracks)
+        return tracks
+
+    def set(self, phrase, market, max_results, tracks):
+        key = self.make_key(phrase, market, max_results)
+        self._memory_set(key, time.time(), tracks)
+
+        if self._path is None:
+            return
+
+        try:
+            self._store(key, tracks)
+        except sqlite3.Error as e:
+            logger.warning(f"Search cache write failed: {e}")
+
+    def clear(self):
+        """
+        Clears the in-memory layer only; the on-disk cache is left untouched.
+        """
+        with self._memory_lock:
+            self._memory.clear()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _memory_get(self, key):
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            stored_at, tracks = entry
+            if time.time() - stored_at > self._ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return tracks
+
+    def _memory_set(self, key, stored_at, tracks):
+        with self._memory_lock:
+            self._memory[key] = (stored_at, tracks)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._max_entries:
+                self._memory.popitem(last=False)
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads, so keep one each
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self, connection):
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version != CACHE_SCHEMA_VERSION:
+            connection.execute("DROP TABLE IF EXISTS search_cache")
+            connection.execute(f"PRAGMA user_version={CACHE_SCHEMA_VERSION}")
+
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            " key TEXT PRIMARY KEY,"
+            " tracks TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS search_cache_last_access"
+            " ON search_cache (last_access)"
+        )
+
+    def _load(self, key):
+        """
+        Returns (stored_at, tracks) for `key`, or None if missing or expired.
+        """
+        connection = self._connection()
+        now = time.time()
+
+        row = connection.execute(
+            "SELECT tracks, stored_at FROM search_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        tracks, stored_at = row
+        if now - stored_at > self._ttl:
+            connection.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+            return None
+
+        connection.execute(
+            "UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key)
+        )
+        return stored_at, [track_from_row(row) for row in json.loads(tracks)]
+
+    def _store(self, key, tracks):
+        connection = self._connection()
+        now = time.time()
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO search_cache (key, tracks, stored_at, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps([track.to_row() for track in tracks]), now, now),
+            )
+            (count,) = connection.execute(
+                "SELECT COUNT(*) FROM search_cache"
+            ).fetchone()
+            if count > self._max_entries:
+                # Evict the least recently used rows to get back under the limit
+                connection.execute(
+                    "DELETE FROM search_cache WHERE key IN ("
+                    " SELECT key FROM search_cache ORDER BY last_access LIMIT ?)",
+                    (count - self._max_entries,),
+                )
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+
+song_search_cache = SearchCache()
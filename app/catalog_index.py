@@ -0,0 +1,322 @@
+"""
+A local, read-only index of track titles, built from an offline catalog
+dump, so common phrases resolve without calling the Spotify API.
+
+    python -m app.catalog_index --output catalog.idx tracks.csv more_tracks.jsonl
+
+Input rows need a track `id` and `name`, and may have `popularity`,
+`artist` (or Spotify-style `artists`), `uri` and `available_markets`. CSV
+files need a header row. The index is a sorted table keyed by canonical
+title, read through mmap with a binary search, so opening it is instant
+and lookups don't load the whole file.
+
+An index is built for one market (--market, US by default, like our
+searches). Tracks not available there are left out, and the index is only
+used for searches in that market.
+"""
+
+import argparse
+import bisect
+import csv
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+
+from app.normalize import canonical_phrase
+from app.tracks import track_from_row
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"SPTYIDX2"
+# Magic, the market (ISO country code) and the number of titles (uint64,
+# little-endian)
+HEADER = struct.Struct("<8s2sQ")
+OFFSET = struct.Struct("<Q")
+# More tracks than this for one title are never asked for
+MAX_TRACKS_PER_TITLE = 50
+# Rows sorted in memory at once while building an index; the rest wait in
+# sorted temporary files
+SORT_CHUNK_ROWS = 100_000
+
+
+class CatalogIndex:
+    """
+    Lookups of tracks by title in an index file built by
+    `build_catalog_index`.
+
+    The file is laid out as a header, a table of record offsets sorted by
+    title, and the records, each the canonical title, a NUL byte and the
+    tracks (as JSON `Track.to_row` rows, most popular first), ending in a
+    newline.
+    """
+
+    def __init__(self):
+        self._path = None
+        self._mmap = None
+        self._market = None
+        self._count = 0
+
+    def configure(self, path=None):
+        """
+        Opens the index at `path` (or disables the index if `path` is None).
+        """
+        self.close()
+        if path is None:
+            return
+
+        try:
+            with open(path, "rb") as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, market, count = HEADER.unpack_from(index, 0)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(
+                f"Unable to open catalog index at {path} ({e}), ignoring it."
+            )
+            return
+
+        if magic != INDEX_MAGIC:
+            logger.warning(
+                f"{path} is not a catalog index (or was built by an older "
+                "version, rebuild it), ignoring it."
+            )
+            index.close()
+            return
+
+        self._path = path
+        self._mmap = index
+        self._market = market.decode()
+        self._count = count
+        logger.info(
+            f"Using catalog index at {path} ({count:,} titles, "
+            f"market {self._market})"
+        )
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._path = None
+        self._mmap = None
+        self._market = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def get(self, phrase, market, max_results=20):
+        """
+        Returns the tracks titled `phrase` (compared in canonical form)
+        available in `market`, most popular first, or None if the title
+        isn't in the index or the index wasn't built for `market`.
+        """
+        if self._mmap is None or market != self._market:
+            return None
+
+        key = canonical_phrase(phrase).encode()
+        position = bisect.bisect_left(_Keys(self), key)
+        if position == self._count or self._key(position) != key:
+            return None
+
+        start = self._offset(position) + len(key) + 1
+        end = self._mmap.find(b"\n", start)
+        rows = json.loads(self._mmap[start:end])
+        return [track_from_row(row) for row in rows[:max_results]]
+
+    def _offset(self, position):
+        offset_position = HEADER.size + position * OFFSET.size
+        (offset,) = OFFSET.unpack_from(self._mmap, offset_position)
+        return offset
+
+    def _key(self, position):
+        start = self._offset(position)
+        return self._mmap[start : self._mmap.find(b"\0", start)]
+
+
+class _Keys:
+    """
+    The index's sorted titles as a sequence, read on demand, for bisect.
+    """
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index._count
+
+    def __getitem__(self, position):
+        return self._index._key(position)
+
+
+def read_catalog_rows(path, market=None):
+    """
+    Yields (id, name, popularity, artist, uri) rows from a CSV or JSONL
+    catalog file, skipping (and logging) rows without an id or name, or
+    with a popularity that isn't a number.
+    With a `market`, rows whose `available_markets` don't include it are
+    skipped too; rows that don't list their markets are kept.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+
+        for line_number, record in enumerate(records, start=1):
+            track_id = record.get("id")
+            name = record.get("name")
+            if not track_id or not name:
+                logger.warning(
+                    f"{path}:{line_number}: missing 'id' or 'name', skipped."
+                )
+                continue
+
+            markets = record.get("available_markets")
+            if isinstance(markets, str):
+                # CSV columns hold the markets as "US,GB,..."
+                markets = [code.strip() for code in markets.split(",") if code.strip()]
+            if market and markets and market not in markets:
+                continue
+
+            try:
+                popularity = int(record.get("popularity") or 0)
+            except (TypeError, ValueError):
+                logger.warning(
+                    f"{path}:{line_number}: invalid 'popularity' "
+                    f"{record['popularity']!r}, skipped."
+                )
+                continue
+
+            artist = record.get("artist")
+            if not artist and record.get("artists"):
+                artist = record["artists"][0]["name"]
+
+            yield (
+                track_id,
+                name,
+                popularity,
+                artist or "Unknown",
+                record.get("uri") or f"spotify:track:{track_id}",
+            )
+
+
+def build_catalog_index(input_paths, output_path, market):
+    """
+    Builds an index file at `output_path` for `market` from CSV/JSONL
+    catalog files. Returns the number of distinct titles indexed.
+
+    The rows are streamed: they are sorted by title in chunks of
+    SORT_CHUNK_ROWS, spilled to temporary files and merged, so only one
+    chunk, and one offset per title, is held in memory at a time.
+    """
+    output_directory = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(dir=output_directory) as work_directory:
+        chunk_paths = []
+        track_count = 0
+        keyed_rows = (
+            (key, list(row))
+            for path in input_paths
+            for row in read_catalog_rows(path, market)
+            if (key := canonical_phrase(row[1]))
+        )
+        while chunk := list(itertools.islice(keyed_rows, SORT_CHUNK_ROWS)):
+            track_count += len(chunk)
+            chunk_paths.append(_write_sorted_chunk(chunk, work_directory))
+
+        # Records go to their own file first: the offset table in front of
+        # them is only known once every title has been seen
+        records_path = os.path.join(work_directory, "records")
+        offsets = array("Q")
+        with open(records_path, "wb") as records:
+            chunks = [_read_chunk(path) for path in chunk_paths]
+            # The merge is stable, so equally popular tracks keep their order
+            merged = heapq.merge(*chunks, key=lambda entry: entry[0])
+            for key, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+                rows = heapq.nlargest(
+                    MAX_TRACKS_PER_TITLE,
+                    (row for _, row in entries),
+                    key=lambda row: row[2],
+                )
+                offsets.append(records.tell())
+                records.write(key.encode() + b"\0" + json.dumps(rows).encode() + b"\n")
+
+        # Write to a temporary file first, so a running search never sees a
+        # half-written index
+        temporary_path = f"{output_path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(HEADER.pack(INDEX_MAGIC, market.encode(), len(offsets)))
+            records_start = HEADER.size + len(offsets) * OFFSET.size
+            for offset in offsets:
+                f.write(OFFSET.pack(records_start + offset))
+            with open(records_path, "rb") as records:
+                shutil.copyfileobj(records, f)
+        os.replace(temporary_path, output_path)
+
+    logger.info(
+        f"Indexed {track_count:,} tracks under {len(offsets):,} titles "
+        f"for market {market} in {output_path}"
+    )
+    return len(offsets)
+
+
+def _write_sorted_chunk(chunk, directory):
+    # Python sorts str by code point, which is also the order of their
+    # UTF-8 bytes, so the index's binary search agrees with this order
+    chunk.sort(key=lambda entry: entry[0])
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=directory, suffix=".chunk", delete=False
+    ) as f:
+        for entry in chunk:
+            f.write(json.dumps(entry) + "\n")
+    return f.name
+
+
+def _read_chunk(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+local_catalog = CatalogIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a local catalog index from CSV/JSONL track dumps."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="CSV (with a header row) or JSONL files of tracks.",
+    )
+    parser.add_argument(
+        "--output", type=str, required=True, help="Path of the index file to write."
+    )
+    parser.add_argument(
+        "--market",
+        type=str,
+        default="US",
+        help=(
+            "Market (ISO country code) to index tracks for; use the market "
+            "searches run in (default: US)"
+        ),
+    )
+    args = parser.parse_args()
+    if len(args.market) != 2:
+        parser.error("--market must be a two-letter country code.")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    build_catalog_index(args.inputs, args.output, args.market.upper())
+
+
+if __name__ == "__main__":
+    main()
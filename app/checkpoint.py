@@ -0,0 +1,269 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from app.tracks import track_from_row
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "spotty", "checkpoints"
+)
+# Save enumeration progress at most this often
+CHECKPOINT_INTERVAL = 30  # seconds
+
+# Bump whenever the layout of the checkpoint file changes
+CHECKPOINT_VERSION = 1
+
+
+def default_checkpoint_path(settings):
+    """
+    Returns the checkpoint path for a run with these search `settings`, one
+    file per distinct search, so runs of different searches never overwrite
+    each other's progress.
+    """
+    encoded = json.dumps(settings, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(encoded).hexdigest()[:16]
+    return os.path.join(DEFAULT_CHECKPOINT_DIR, f"{digest}.json.gz")
+
+
+class SearchInterrupted(Exception):
+    """
+    Raised in a sentence's search once the run has been interrupted and its
+    progress saved.
+    """
+
+
+class RunCheckpoint:
+    """
+    Saves the progress of a run's sentence searches to a gzipped JSON file,
+    so an interrupted run can be resumed with `--resume`.
+
+    For each sentence it records the tracks found for every phrase, how
+    many groupings the enumeration has checked and the best candidates so
+    far, and the final playlists once the sentence is done. Tracks are
+    stored once, in a shared table, and referred to by index.
+
+    A checkpoint is only resumed for the same search settings (`settings`),
+    otherwise the run starts from scratch.
+    """
+
+    def __init__(self, path, settings, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.settings = settings
+        self.interval = interval
+        self.interrupted = threading.Event()
+        self._lock = threading.Lock()
+        self._sentences = {}
+        self._last_save = time.monotonic()
+
+    def load(self):
+        """
+        Loads the saved progress, if there is any for these settings.
+        Returns True if progress was loaded.
+        """
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            logger.info(f"No checkpoint at {self.path}, starting from scratch.")
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unable to read checkpoint {self.path} ({e}), ignoring it.")
+            return False
+
+        if saved.get("version") != CHECKPOINT_VERSION:
+            logger.warning(
+                f"Checkpoint {self.path} is from another version, ignoring it."
+            )
+            return False
+        if saved.get("settings") != self.settings:
+            logger.warning(
+                f"Checkpoint {self.path} is for a different search, ignoring it."
+            )
+            return False
+
+        tracks = [track_from_row(row) for row in saved["tracks"]]
+
+        def decode(track_lists):
+            if track_lists is None:
+                return None
+            return [[tracks[index] for index in indexes] for indexes in track_lists]
+
+        for index, state in saved["sentences"].items():
+            self._sentences[int(index)] = {
+                "sentence": state["sentence"],
+                "resolved": decode(state["resolved"]),
+                "position": state["position"],
+                "candidates": decode(state["candidates"]),
+                "playlists": decode(state["playlists"]),
+            }
+
+        logger.info(f"Resuming from checkpoint {self.path}")
+        return True
+
+    def for_sentence(self, index, sentence):
+        """
+        Returns the SentenceCheckpoint of sentence number `index`.
+        """
+        with self._lock:
+            state = self._sentences.get(index)
+            if state is None or state["sentence"] != sentence:
+                state = self._sentences[index] = {
+                    "sentence": sentence,
+                    "resolved": None,
+                    "position": 0,
+                    "candidates": [],
+                    "playlists": None,
+                }
+        return SentenceCheckpoint(self, state)
+
+    def interrupt(self):
+        """
+        Saves the progress and makes every running enumeration stop.
+        """
+        self.interrupted.set()
+        self.save()
+
+    def save(self):
+        """
+        Writes the progress so far, replacing the file atomically.
+        """
+        with self._lock:
+            track_indexes = {}
+            tracks = []
+
+            def encode(track_lists):
+                if track_lists is None:
+                    return None
+                encoded = []
+                for track_list in track_lists:
+                    indexes = []
+                    for track in track_list:
+                        if track.id not in track_indexes:
+                            track_indexes[track.id] = len(tracks)
+                            tracks.append(track.to_row())
+                        indexes.append(track_indexes[track.id])
+                    encoded.append(indexes)
+                return encoded
+
+            sentences = {
+                index: {
+                    "sentence": state["sentence"],
+                    "resolved": encode(state["resolved"]),
+                    "position": state["position"],
+                    "candidates": encode(state["candidates"]),
+                    "playlists": encode(state["playlists"]),
+                }
+                for index, state in self._sentences.items()
+            }
+            saved = {
+                "version": CHECKPOINT_VERSION,
+                "settings": self.settings,
+                "tracks": tracks,
+                "sentences": sentences,
+            }
+
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                temporary_path = f"{self.path}.tmp"
+                with gzip.open(temporary_path, "wt", encoding="utf-8") as f:
+                    json.dump(saved, f, separators=(",", ":"))
+                os.replace(temporary_path, self.path)
+            except OSError as e:
+                logger.warning(f"Unable to save checkpoint {self.path}: {e}")
+            self._last_save = time.monotonic()
+
+    def exists(self):
+        """
+        Returns True if there is saved progress at `path`, e.g. from an
+        interrupted run.
+        """
+        return os.path.exists(self.path)
+
+    def is_due(self):
+        """
+        Returns True if the last save was at least `interval` seconds ago.
+        """
+        return time.monotonic() - self._last_save >= self.interval
+
+    def remove(self):
+        """
+        Deletes the checkpoint file, once the run no longer needs it.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Unable to remove checkpoint {self.path}: {e}")
+
+
+class SentenceCheckpoint:
+    """
+    One sentence's saved progress within a RunCheckpoint.
+    """
+
+    def __init__(self, run, state):
+        self._run = run
+        self._state = state
+
+    @property
+    def resolved(self):
+        return self._state["resolved"]
+
+    @property
+    def position(self):
+        return self._state["position"]
+
+    @property
+    def candidates(self):
+        return self._state["candidates"]
+
+    @property
+    def playlists(self):
+        return self._state["playlists"]
+
+    def check_interrupted(self):
+        """
+        Raises SearchInterrupted if the run was interrupted. Used where
+        there is no progress to save other than what is saved as it's made.
+        """
+        if self._run.interrupted.is_set():
+            raise SearchInterrupted()
+
+    def save_resolved(self, resolved):
+        with self._run._lock:
+            self._state["resolved"] = resolved
+        self._run.save()
+
+    def save_progress(self, position, get_candidates):
+        """
+        Records that the first `position` groupings have been checked, and
+        saves if it's time to. `get_candidates` returns the best candidates
+        so far; it is only called when saving.
+        Raises SearchInterrupted (after saving) if the run was interrupted.
+        """
+        interrupted = self._run.interrupted.is_set()
+        if not interrupted and not self._run.is_due():
+            return
+
+        with self._run._lock:
+            self._state["position"] = position
+            self._state["candidates"] = get_candidates()
+        self._run.save()
+
+        if interrupted:
+            raise SearchInterrupted()
+
+    def save_done(self, playlists):
+        with self._run._lock:
+            self._state["playlists"] = playlists
+            self._state["candidates"] = []
+        self._run.save()
@@ -1,5 +1,138 @@
 import argparse
 
+from app.caching import (
+    DEFAULT_CACHE_MAX_ENTRIES,
+    DEFAULT_CACHE_PATH,
+    DEFAULT_CACHE_TTL,
+)
+from app.checkpoint import DEFAULT_CHECKPOINT_DIR
+from app.scoring import SCORERS
+
+
+def positive_int(value):
+    """
+    argparse type for counts that must be at least 1, such as thread counts.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def add_search_arguments(parser):
+    """
+    Adds the arguments shared by every entry point that searches Spotify.
+    """
+    parser.add_argument(
+        "--max-words",
+        type=int,
+        default=4,
+        help="Maximum grouping of words to attempt in permutations.",
+    )
+    parser.add_argument("--access-token", type=str, help="Spotify OAuth access token.")
+    parser.add_argument(
+        "--refresh-token",
+        type=str,
+        help=(
+            "Spotify OAuth refresh token, used with --client-id and --client-secret "
+            "to get a new access token when it expires."
+        ),
+    )
+    parser.add_argument("--client-id", type=str, help="Spotify Client ID.")
+    parser.add_argument("--client-secret", type=str, help="Spotify Client Secret.")
+    parser.add_argument(
+        "--token-url",
+        type=str,
+        help=(
+            "Get (and refresh) the access token from a running API server instead, "
+            "e.g. http://localhost:8888/token."
+        ),
+    )
+    parser.add_argument(
+        "--max-search-results",
+        type=int,
+        default=20,
+        help="Maximum number of search results from Spotify for each song name.",
+    )
+    parser.add_argument(
+        "--score",
+        type=str,
+        choices=sorted(SCORERS),
+        default="popularity",
+        help="How to score (and rank) potential playlists.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default=4,
+        help="Maximum number of Spotify searches to run at the same time.",
+    )
+    parser.add_argument(
+        "--sentence-concurrency",
+        type=positive_int,
+        default=4,
+        help="Maximum number of sentences to search at the same time.",
+    )
+    parser.add_argument(
+        "--http-pool-size",
+        type=positive_int,
+        help=(
+            "Number of keep-alive connections to keep open to the Spotify API "
+            "(default: one per concurrent search, --concurrency x "
+            "--sentence-concurrency)."
+        ),
+    )
+    parser.add_argument(
+        "--cache-path",
+        type=str,
+        default=DEFAULT_CACHE_PATH,
+        help=f"Path of the persistent search cache (default: {DEFAULT_CACHE_PATH}).",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=DEFAULT_CACHE_TTL,
+        help="Seconds before a cached search result expires.",
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=DEFAULT_CACHE_MAX_ENTRIES,
+        help="Maximum number of cached searches before the least recently used are evicted.",
+    )
+    parser.add_argument(
+        "--no-persistent-cache",
+        action="store_true",
+        help="Only cache search results in memory for this run.",
+    )
+    parser.add_argument(
+        "--catalog-index",
+        type=str,
+        help=(
+            "Look titles up in this local catalog index (see app.catalog_index) "
+            "before searching Spotify."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-output",
+        type=str,
+        help="Also write the end-of-run metrics summary to this JSON file.",
+    )
+
+
+def check_token_arguments(parser, args):
+    """
+    Exits with a usage error unless there's some way to get an access token.
+    """
+    can_refresh = args.refresh_token and args.client_id and args.client_secret
+    if not (args.access_token or can_refresh or args.token_url):
+        parser.error(
+            "One of --access-token, --token-url or --refresh-token "
+            "(with --client-id and --client-secret) is required."
+        )
+    if args.refresh_token and not (args.client_id and args.client_secret):
+        parser.error("--refresh-token needs --client-id and --client-secret.")
+
 
 def parse_arguments():
     """
@@ -25,22 +158,74 @@ def parse_arguments():
         help="Use an existing Spotify playlist ID (cannot be used with --playlist-name).",
     )
     parser.add_argument(
-        "--max-words",
+        "--strategy",
+        type=str,
+        choices=["auto", "enumerate", "lattice", "ranked", "windowed"],
+        default="auto",
+        help=(
+            "How to search for playlists. 'enumerate' checks every permutation, "
+            "'lattice' searches each distinct phrase once and walks the phrase graph, "
+            "'ranked' does the same but only keeps the --top-k best playlists, "
+            "'windowed' solves long sentences a few dozen words at a time. "
+            "'auto' picks one per sentence from its predicted size."
+        ),
+    )
+    parser.add_argument(
+        "--top-k",
         type=int,
-        default=4,
-        help="Maximum grouping of words to attempt in permutations.",
+        default=10,
+        help="Number of best-scoring playlists to keep (0 keeps every one).",
     )
     parser.add_argument(
-        "--access-token", type=str, required=True, help="Spotify OAuth access token."
+        "--processes",
+        type=int,
+        default=1,
+        help=(
+            "Check the permutations of large sentences, and solve the windows "
+            "of windowed ones, in this many worker processes (0 uses one per "
+            "CPU core)."
+        ),
     )
     parser.add_argument(
-        "--max-search-results",
+        "--max-api-calls",
         type=int,
-        default=20,
-        help="Maximum number of search results from Spotify for each song name.",
+        help="Lower --max-words where needed to search Spotify at most this often.",
     )
+    parser.add_argument(
+        "--max-memory-mb",
+        type=int,
+        help="Lower --max-words where needed to keep the search under this memory.",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        help="Lower --max-words where needed to finish in about this many seconds.",
+    )
+    parser.add_argument(
+        "--checkpoint-path",
+        type=str,
+        help=(
+            "Where to save search progress (default: one file per search "
+            f"under {DEFAULT_CHECKPOINT_DIR})."
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue an interrupted run from its saved progress "
+            "(run with the same arguments)."
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Start over even if an interrupted run's progress is saved.",
+    )
+    add_search_arguments(parser)
 
     args = parser.parse_args()
+    check_token_arguments(parser, args)
 
     # If both playlist-name and playlist-id are provided, raise an error.
     if args.playlist_name and args.playlist_id:
@@ -49,3 +234,42 @@ def parse_arguments():
         )
 
     return args
+
+
+def parse_batch_arguments():
+    """
+    Parses command-line arguments for the headless batch mode.
+    """
+    parser = argparse.ArgumentParser(
+        description=(
+            "Process many search strings from a JSONL file without prompting, "
+            "picking the best-scoring playlist for each."
+        )
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help=(
+            "JSONL file with one job per line, e.g. "
+            '{"search_string": "...", "playlist_name": "...", "max_words": 4}. '
+            'Use "playlist_id" instead of "playlist_name" to add to an existing playlist.'
+        ),
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="-",
+        help="Where to write one JSON result per job (default: stdout).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Find the best playlists but don't create or change any playlists.",
+    )
+    add_search_arguments(parser)
+
+    args = parser.parse_args()
+    check_token_arguments(parser, args)
+
+    return args
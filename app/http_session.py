@@ -0,0 +1,44 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# The fewest keep-alive connections kept open; more are kept when more
+# requests can run at once, so none is discarded after use
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_session = None
+_pool_size = DEFAULT_POOL_SIZE
+
+
+def configure_http_session(pool_size=None, concurrent_requests=0):
+    """
+    Sets the number of keep-alive connections kept open per host: `pool_size`,
+    or if None, enough for `concurrent_requests` requests at once (and at
+    least DEFAULT_POOL_SIZE). The shared session is rebuilt on its next use.
+    """
+    global _session, _pool_size
+    if pool_size is None:
+        pool_size = max(DEFAULT_POOL_SIZE, concurrent_requests)
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _pool_size = pool_size
+
+
+def get_session():
+    """
+    Returns the process-wide requests.Session, creating it on first use.
+    Reusing it keeps TCP/TLS connections to the API alive between calls.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=_pool_size, pool_maxsize=_pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
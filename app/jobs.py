@@ -0,0 +1,215 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.auth import TokenManager
+from app.pipeline import JobError, find_best_playlist
+from app.scoring import SCORERS, get_scorer
+from app.spotify_api import add_tracks_to_playlist, create_playlist
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_WORKERS = 4
+DEFAULT_MAX_QUEUED_JOBS = 100
+# Spotify searches in flight at once, across every running job
+DEFAULT_JOB_CONCURRENCY = 16
+# Each extra word multiplies the work a job can ask for
+MAX_JOB_MAX_WORDS = 10
+# Finished jobs beyond this many are forgotten, oldest first
+MAX_FINISHED_JOBS = 1000
+
+
+class Job:
+    """
+    A playlist generation request and its progress.
+    Status goes queued -> running -> done (or failed).
+    """
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "search_string": self.params.get("search_string"),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class QueueFullError(Exception):
+    """
+    Raised when too many jobs are already waiting to run.
+    """
+
+
+def validate_job_params(params, require_access_token=True):
+    """
+    Returns an error message for invalid job parameters, or None if valid.
+    Batch jobs use the token given on the command line, so they pass
+    `require_access_token=False`.
+    """
+    if not isinstance(params, dict):
+        return "Expected a JSON object."
+    if not params.get("search_string"):
+        return "Missing 'search_string'."
+    if not isinstance(params["search_string"], str):
+        return "'search_string' must be a string."
+    if require_access_token:
+        if not params.get("access_token"):
+            return "Missing 'access_token'."
+        if not isinstance(params["access_token"], (str, TokenManager)):
+            return "'access_token' must be a string."
+    for field in ("playlist_name", "playlist_id"):
+        if params.get(field) is not None and not isinstance(params[field], str):
+            return f"'{field}' must be a string."
+    if params.get("playlist_name") and params.get("playlist_id"):
+        return "Cannot specify both 'playlist_name' and 'playlist_id'."
+    score = params.get("score", "popularity")
+    if not isinstance(score, str) or score not in SCORERS:
+        return f"'score' must be one of {sorted(SCORERS)}."
+    max_words = params.get("max_words", 4)
+    # bool is an int subclass, but `true` is no word count
+    if (
+        isinstance(max_words, bool)
+        or not isinstance(max_words, int)
+        or not 1 <= max_words <= MAX_JOB_MAX_WORDS
+    ):
+        return f"'max_words' must be an integer from 1 to {MAX_JOB_MAX_WORDS}."
+    return None
+
+
+class JobManager:
+    """
+    Runs playlist generation jobs on a bounded pool of worker threads.
+
+    All jobs share the process-wide search cache, HTTP session and in-flight
+    search coalescing, so a phrase searched by one job is free for every
+    job after it, and concurrent jobs searching the same phrase share one
+    request.
+
+    `concurrency` caps the searches in flight across all running jobs: each
+    job searches its sentences one at a time, with an equal share of it.
+    """
+
+    def __init__(
+        self,
+        max_workers=DEFAULT_JOB_WORKERS,
+        max_queued=DEFAULT_MAX_QUEUED_JOBS,
+        concurrency=DEFAULT_JOB_CONCURRENCY,
+        max_results=20,
+    ):
+        self.max_queued = max_queued
+        self.concurrency = concurrency
+        self.job_concurrency = max(1, concurrency // max_workers)
+        self.max_results = max_results
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def submit(self, params):
+        """
+        Queues a job and returns it. Raises QueueFullError if too many jobs
+        are already waiting.
+        """
+        with self._lock:
+            queued = sum(job.status == "queued" for job in self._jobs.values())
+            if queued >= self.max_queued:
+                raise QueueFullError(f"{queued} jobs are already queued.")
+
+            job = Job(params)
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forget_finished_jobs(self):
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in ("done", "failed")
+        ]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+
+        try:
+            job.result = self._generate(job.params)
+            job.status = "done"
+        except JobError as e:
+            job.error = str(e)
+            job.status = "failed"
+        # get_user_id calls sys.exit when it can't find the user, which
+        # must only fail this job, not the worker
+        except (Exception, SystemExit) as e:
+            logger.exception(f"Job {job.id} failed unexpectedly.")
+            job.error = repr(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _generate(self, params):
+        access_token = params["access_token"]
+        scorer = get_scorer(params.get("score", "popularity"))
+
+        tracks = find_best_playlist(
+            params["search_string"],
+            access_token,
+            params.get("max_words", 4),
+            scorer,
+            max_results=self.max_results,
+            concurrency=self.job_concurrency,
+            sentence_concurrency=1,
+        )
+        result = {
+            "score": scorer.score(tracks),
+            "tracks": [track.to_dict() for track in tracks],
+        }
+
+        playlist_id = params.get("playlist_id")
+        playlist_name = params.get("playlist_name")
+        if not playlist_id and not playlist_name:
+            return result
+
+        if playlist_id is None:
+            created_playlist = create_playlist(access_token, playlist_name)
+            if not created_playlist:
+                raise JobError("Playlist creation failed.")
+            playlist_id = created_playlist["id"]
+
+        if not add_tracks_to_playlist(access_token, playlist_id, tracks):
+            raise JobError(f"Adding tracks to playlist {playlist_id} failed.")
+
+        result["playlist_id"] = playlist_id
+        return result
@@ -0,0 +1,141 @@
+import heapq
+import itertools
+
+
+def iter_sentence_spans(word_count, max_word_count):
+    """
+    Yields every (start, end) word span of a sentence that is at most
+    `max_word_count` words long. There are roughly word_count * max_word_count
+    of these, compared to the exponential number of groupings.
+    """
+    for start in range(word_count):
+        for end in range(start + 1, min(start + max_word_count, word_count) + 1):
+            yield start, end
+
+
+def lattice_from_phrase_table(phrase_table, resolved):
+    """
+    Builds a DAG over word positions 0..len(words) where each edge
+    (start -> end) is a phrase `words[start:end]` that has matching tracks,
+    from the already searched `phrase_table`. `resolved` is a list of track
+    lists indexed by phrase ID.
+
+    Returns a list indexed by start position, each entry being a list of
+    (end, phrase, tracks) edges. Edges that cannot reach the end of the
+    sentence are pruned.
+    """
+    edges = [[] for _ in range(len(phrase_table.words))]
+
+    for phrase_id, (start, end) in enumerate(phrase_table.spans):
+        if resolved[phrase_id]:
+            edges[start].append(
+                (end, phrase_table.phrases[phrase_id], resolved[phrase_id])
+            )
+
+    return prune_lattice(edges)
+
+
+def prune_lattice(edges):
+    """
+    Removes every edge whose end position cannot reach the end of the sentence.
+    After pruning, any walk from position 0 is guaranteed to complete, so
+    walking the lattice never explores dead branches.
+    """
+    word_count = len(edges)
+    reaches_end = [False] * (word_count + 1)
+    reaches_end[word_count] = True
+
+    # Single backwards pass: a position reaches the end if any edge does
+    for start in range(word_count - 1, -1, -1):
+        edges[start] = [edge for edge in edges[start] if reaches_end[edge[0]]]
+        reaches_end[start] = bool(edges[start])
+
+    return edges
+
+
+def count_lattice_segmentations(edges):
+    """
+    Counts the valid segmentations in a (pruned) lattice without walking it.
+    """
+    word_count = len(edges)
+    counts = [0] * (word_count + 1)
+    counts[word_count] = 1
+
+    for start in range(word_count - 1, -1, -1):
+        counts[start] = sum(counts[end] for end, _, _ in edges[start])
+
+    return counts[0]
+
+
+def iter_lattice_segmentations(edges):
+    """
+    Walks a pruned lattice depth-first from position 0, yielding each valid
+    segmentation as a list of (phrase, tracks) pairs.
+    Segmentations come out in the same order as the permutation generators.
+    """
+    word_count = len(edges)
+    if word_count == 0:
+        return
+
+    stack = [(0, [])]
+    while stack:
+        start, path = stack.pop()
+
+        if start == word_count:
+            yield path
+            continue
+
+        # Push in reverse so the shortest first phrase is walked first
+        for end, phrase, tracks in reversed(edges[start]):
+            stack.append((end, path + [(phrase, tracks)]))
+
+
+def iter_best_segmentations(edges, scorer):
+    """
+    Yields segmentations of a pruned lattice in descending `scorer` order,
+    each as a (score, tracks) pair using the best (first) track per phrase.
+
+    This is a best-first search over partial paths, bounded by the best
+    possible remaining edge weight from each position (computed with one
+    backwards DP pass). Only the frontier is held in memory, so taking the
+    first K results costs roughly K * len(edges) expansions instead of
+    materializing every segmentation.
+    """
+    word_count = len(edges)
+    if word_count == 0:
+        return
+
+    best_edges = [
+        [(end, tracks[0]) for end, _, tracks in edges[start]]
+        for start in range(word_count)
+    ]
+
+    # best_suffix[i] = highest total edge weight of any path from i to the end
+    best_suffix = [float("-inf")] * (word_count + 1)
+    best_suffix[word_count] = 0
+    for start in range(word_count - 1, -1, -1):
+        for end, track in best_edges[start]:
+            best_suffix[start] = max(
+                best_suffix[start], scorer.edge_weight(track) + best_suffix[end]
+            )
+
+    # Heap of (-upper bound, tie breaker, position, tracks so far)
+    counter = itertools.count()
+    heap = [(-best_suffix[0], next(counter), 0, ())]
+
+    while heap:
+        neg_bound, _, start, tracks = heapq.heappop(heap)
+
+        if start == word_count:
+            # Complete paths are pushed with their exact score, so nothing
+            # left on the heap can beat this one.
+            yield -neg_bound, list(tracks)
+            continue
+
+        for end, track in best_edges[start]:
+            next_tracks = tracks + (track,)
+            if end == word_count:
+                bound = scorer.score(next_tracks)
+            else:
+                bound = scorer.score(next_tracks) + best_suffix[end]
+            heapq.heappush(heap, (-bound, next(counter), end, next_tracks))
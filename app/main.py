@@ -1,16 +1,25 @@
+import atexit
 import logging
 import sys
 
+from app.auth import token_manager_from_args
 from app.cli import parse_arguments
-from app.spotify_api import create_playlist, add_tracks_to_playlist
+from app.spotify_api import SearchError, add_tracks_to_playlist, create_playlist
 from app.caching import song_search_cache
-from app.permutations import generate_all_sentence_permutations
-from app.prompts import yes_no_select, scrollable_playlist_view
-from InquirerPy import inquirer
+from app.catalog_index import local_catalog
+from app.checkpoint import RunCheckpoint, default_checkpoint_path
+from app.http_session import configure_http_session
+from app.metrics import report_metrics_summary
+from app.permutations import split_into_sentences
+from app.pipeline import find_all_sentence_playlists
+from app.planner import Budget, plan_search
+from app.sharding import resolve_processes
+from app.prompts import choose_playlist, yes_no_select, scrollable_playlist_view
+from app.ranking import LazyRankedList
+from app.scoring import get_scorer
 
 # ANSI color codes (for terminal color). Adjust as needed.
 GREEN = "\033[92m"
-RED = "\033[91m"
 RESET = "\033[0m"
 
 logging.basicConfig(
@@ -21,23 +30,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def fetch_tracks_for_grouping(grouping, access_token, max_results=20):
-    """
-    For each term in `grouping`, fetch exact matching tracks from Spotify.
-    If any term has no matching tracks, return None for that entire permutation.
-    Otherwise, returns a list of track lists (parallel to each term).
-    """
-    from app.spotify_api import search_song_by_name  # local import to avoid circular
-
-    all_tracks = []
-    for term in grouping:
-        tracks = search_song_by_name(term, access_token, max_results)
-        if not tracks:
-            return None
-        all_tracks.append(tracks)
-    return all_tracks
-
-
 def main():
     global song_search_cache
     args = parse_arguments()
@@ -46,106 +38,154 @@ def main():
     playlist_name = args.playlist_name
     playlist_id = args.playlist_id
     max_words = args.max_words
-    access_token = args.access_token
+    # Refreshed as needed, so long runs outlive the hour a token lasts
+    access_token = token_manager_from_args(args)
     max_search_results = args.max_search_results
+    strategy = args.strategy
+    scorer = get_scorer(args.score)
+    processes = resolve_processes(args.processes)
 
     logger.info(f"{GREEN}Starting the Spotify playlist script...{RESET}")
+
+    # Runs however the run ends, including sys.exit and Ctrl-C
+    atexit.register(report_metrics_summary, args.metrics_output)
+
+    # Each sentence runs its own searches at once
+    configure_http_session(
+        pool_size=args.http_pool_size,
+        concurrent_requests=args.concurrency * args.sentence_concurrency,
+    )
+    song_search_cache.configure(
+        path=None if args.no_persistent_cache else args.cache_path,
+        ttl=args.cache_ttl,
+        max_entries=args.cache_max_entries,
+    )
+    local_catalog.configure(args.catalog_index)
     logger.info(
         f"Search string: '{search_string}', Playlist name: '{playlist_name}', Playlist id: '{playlist_id}"
     )
 
-    sentences, sentence_permutations = generate_all_sentence_permutations(
-        search_string, max_word_count_per_sentence=max_words
-    )
+    logger.info(f"Checking text\n   {search_string}\n")
+    sentences = split_into_sentences(search_string)
 
-    all_potential_playlists = []
+    logger.info(
+        f"Checking {len(sentences)} sentence(s), "
+        f"up to {args.sentence_concurrency} at a time..."
+    )
 
-    for i, word_permutations in enumerate(sentence_permutations):
-        logger.info(
-            f"Found {len(word_permutations):,} permutations in total for sentence {i}."
+    # Decide how to search each sentence, within budget, before searching
+    budget = Budget(
+        max_api_calls=args.max_api_calls,
+        max_memory_mb=args.max_memory_mb,
+        max_seconds=args.time_budget,
+    )
+    plans = plan_search(
+        sentences,
+        max_words,
+        scorer,
+        args.top_k,
+        strategy=None if strategy == "auto" else strategy,
+        budget=budget,
+        concurrency=args.concurrency,
+        processes=processes,
+    )
+    for i, plan in enumerate(plans, start=1):
+        word_count = len(plan.sentence.split())
+        logger.info(f"Sentence {i} ({word_count} words): {plan.describe()}")
+
+    # Progress is saved as we go, so an interrupted run can be resumed
+    settings = {
+        "search_string": search_string,
+        "max_words": max_words,
+        "strategy": strategy,
+        "score": args.score,
+        "top_k": args.top_k,
+        "max_search_results": max_search_results,
+        # The budgets decide each sentence's max_words
+        "budget": vars(budget),
+    }
+    checkpoint = RunCheckpoint(
+        args.checkpoint_path or default_checkpoint_path(settings), settings
+    )
+    if args.resume:
+        checkpoint.load()
+    elif checkpoint.exists() and not args.force:
+        logger.error(
+            f"An interrupted run's progress is saved at {checkpoint.path}. "
+            "Pass --resume to continue it, or --force to start over."
         )
-
-        # Search for tracks for each permutation
-        potential_playlists = []
-
-        logger.info(
-            "Beginning track searches for each permutation. This may take a while..."
+        sys.exit(1)
+
+    try:
+        sentence_playlists = find_all_sentence_playlists(
+            sentences,
+            access_token,
+            max_words,
+            sentence_concurrency=args.sentence_concurrency,
+            checkpoint=checkpoint,
+            plans=plans,
+            scorer=scorer,
+            top_k=args.top_k,
+            max_results=max_search_results,
+            concurrency=args.concurrency,
+            processes=processes,
         )
+    except KeyboardInterrupt:
+        logger.warning(
+            f"Progress saved to {checkpoint.path}. "
+            "Run again with the same arguments and --resume to continue."
+        )
+        sys.exit(130)
+    except SearchError as e:
+        logger.error(
+            f"{e} Progress saved to {checkpoint.path}. "
+            "Run again with the same arguments and --resume to retry."
+        )
+        sys.exit(1)
 
-        total_permutations = len(word_permutations)
-
-        for j, grouping in enumerate(word_permutations, start=1):
-            pct_done = (i / total_permutations) * 100
-            progress_color = RED
-            if len(potential_playlists) > 0:
-                progress_color = GREEN
-
-            sys.stdout.write(
-                f"\r{progress_color}Progress:{RESET} {i:,}/{total_permutations:,} "
-                f"({pct_done:.2f}%) | Potential playlists found: {len(potential_playlists)} [{len(song_search_cache)} API searches]"
-            )
-            sys.stdout.flush()
-
-            all_tracks = fetch_tracks_for_grouping(
-                grouping, access_token, max_results=max_search_results
-            )
-            if not all_tracks:
-                continue
-
-            track_list = []
-            for tracks_for_term in all_tracks:
-                first_track = tracks_for_term[0]
-                track_list.append(
-                    {
-                        "id": first_track["id"],
-                        "name": first_track["name"],
-                        "popularity": first_track["popularity"],
-                        "artist": (
-                            first_track["artists"][0]["name"]
-                            if first_track.get("artists")
-                            else "Unknown"
-                        ),
-                        "uri": first_track["uri"],
-                    }
-                )
-            potential_playlists.append(track_list)
-
-        print()
-
-        print(potential_playlists)
+    all_potential_playlists = []
+    unmatched_sentences = []
+    for sentence, potential_playlists in zip(sentences, sentence_playlists):
         if potential_playlists:
             all_potential_playlists.append(potential_playlists)
         else:
-            logger.warning(
-                f"Unable to make a playlist as no valid sets of tracks matched. Unable to match \n\t'{sentences[i]}'"
-            )
-            sys.exit(0)
+            unmatched_sentences.append(sentence)
+
+    # Report every unmatched sentence at once, and still offer the others
+    for sentence in unmatched_sentences:
+        logger.warning(
+            f"No valid sets of tracks matched. Unable to match \n\t'{sentence}'"
+        )
+    if not all_potential_playlists:
+        logger.warning("Unable to make a playlist as no sentence matched.")
+        checkpoint.remove()
+        sys.exit(0)
+    if unmatched_sentences:
+        logger.warning(
+            f"Continuing with the {len(all_potential_playlists)} matched "
+            f"sentence(s) out of {len(sentences)}."
+        )
 
     for potential_playlists in all_potential_playlists:
-        logger.info(f"Found {len(potential_playlists)} potential playlists total.")
-
-        # Prepare user choices
-        choices = []
-        for idx, playlist in enumerate(potential_playlists, start=1):
-            total_score = sum(t["popularity"] for t in playlist)
-            choice_name = (
-                f"Playlist #{idx} | Score={total_score} | {len(playlist)} track(s)"
-            )
-            choices.append({"name": choice_name, "value": idx - 1})
+        if isinstance(potential_playlists, LazyRankedList):
+            # Counting them would mean ranking every one up front
+            logger.info("Listing potential playlists best first, as they are ranked.")
+        else:
+            logger.info(f"Found {len(potential_playlists)} potential playlists total.")
 
         # Loop until the user creates a playlist or exits
         selecting = True
         while selecting:
-            chosen_idx = inquirer.select(
-                message="Select the playlist you want to examine/create:",
-                choices=choices,
-                instruction="↑/↓ to navigate, Enter to select",
-            ).execute()
+            # Only the page on screen is ranked, scored and formatted
+            chosen_idx = choose_playlist(potential_playlists, scorer)
+            if chosen_idx is None:
+                logger.info("User skipped this sentence.")
+                break
 
             selected_playlist = potential_playlists[chosen_idx]
-            total_score = sum(t["popularity"] for t in selected_playlist)
+            total_score = scorer.score(selected_playlist)
             logger.info(
-                f"You selected playlist #{chosen_idx+1} with total popularity score of {total_score}."
+                f"You selected playlist #{chosen_idx+1} with total {scorer.name} score of {total_score}."
             )
 
             scrollable_playlist_view(selected_playlist)
@@ -169,13 +209,21 @@ def main():
                         logger.error("Playlist creation failed.")
                         break
 
-                add_tracks_to_playlist(access_token, playlist_id, selected_playlist)
+                if add_tracks_to_playlist(access_token, playlist_id, selected_playlist):
+                    logger.info(
+                        f"{GREEN}✅ Added {len(selected_playlist)} track(s) to the playlist.{RESET}"
+                    )
+                else:
+                    logger.error("Adding tracks to the playlist failed.")
                 selecting = False
             else:
                 logger.info(
                     "User chose not to create this playlist. Going back to selection."
                 )
 
+    # Done, nothing left to resume
+    checkpoint.remove()
+
 
 if __name__ == "__main__":
     main()
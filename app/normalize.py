@@ -0,0 +1,49 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Curly, low and prime quotes (and backticks/accents used as apostrophes)
+# all become plain ASCII quotes
+QUOTE_TRANSLATION = str.maketrans(
+    {
+        "‘": "'",
+        "’": "'",
+        "‚": "'",
+        "‛": "'",
+        "′": "'",
+        "`": "'",
+        "´": "'",
+        "“": '"',
+        "”": '"',
+        "„": '"',
+        "‟": '"',
+        "″": '"',
+    }
+)
+
+# Punctuation that isn't between two word characters, e.g. the comma in
+# "love," or the quotes in '"home"', but not the apostrophe in "don't"
+STRAY_PUNCTUATION = re.compile(r"(?<!\w)[^\w\s]+|[^\w\s]+(?!\w)")
+
+
+@lru_cache(maxsize=65536)
+def canonical_phrase(text):
+    """
+    Returns the canonical form of a phrase or track name, used to compare
+    them and as the search cache key: Unicode NFKC, case folded, quotes
+    unified, stray punctuation removed and whitespace collapsed.
+
+    "Love", "love," and "LOVE!" all become "love"; "Don’t Stop" and
+    "don't stop" both become "don't stop".
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = text.translate(QUOTE_TRANSLATION)
+    return " ".join(STRAY_PUNCTUATION.sub(" ", text).split())
+
+
+def clean_sentence(sentence):
+    """
+    Drops the words of `sentence` that are only punctuation (e.g. a lone
+    "-" or "&") and collapses whitespace, keeping the other words as typed.
+    """
+    return " ".join(word for word in sentence.split() if canonical_phrase(word))
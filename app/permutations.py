@@ -1,32 +1,82 @@
+import logging
 import re
 
+from app.normalize import clean_sentence
 
-def generate_all_sentence_permutations(text, max_word_count_per_sentence):
-    print(f"Checking text\n   {text}\n")
+logger = logging.getLogger(__name__)
 
+
+def split_into_sentences(text):
     # Regex to split on . ! ? followed by whitespace or end of string
     sentence_endings = r"(?<=[.!?])\s+"
 
     sentences = re.split(sentence_endings, text)
 
-    # Regex to remove . ! ? from a sentence
-    sentences = [re.sub(r"[.!?]", "", sentence) for sentence in sentences]
-
-    results = []
-
-    for sentence in sentences:
-        print(f'Checking sentence "{sentence}"')
-        sentence_result = generate_sentence_permutations_v2(
-            sentence, max_word_count_per_sentence
-        )
-
-        results.append(sentence_result)
-
-    return sentences, results
-
-
-def count_sentence_permutations(word_count, max_word_count):
-    print(
+    # Regex to remove . ! ? from a sentence, then drop stray punctuation
+    # words (e.g. " - ") and any sentence left empty
+    sentences = [clean_sentence(re.sub(r"[.!?]", "", s)) for s in sentences]
+    return [sentence for sentence in sentences if sentence]
+
+
+class DeadSpanIndex:
+    """
+    Records which word spans (start, end) of a sentence are known to have no
+    matching tracks. Each start position has a bitmask where bit
+    (end - start - 1) is set when words[start:end] is dead, so checks in the
+    permutation generators are a shift and a mask.
+    """
+
+    def __init__(self, word_count):
+        self.word_count = word_count
+        self.masks = [0] * word_count
+
+    def mark_dead(self, start, end):
+        self.masks[start] |= 1 << (end - start - 1)
+
+    def is_dead(self, start, end):
+        return bool(self.masks[start] >> (end - start - 1) & 1)
+
+    def completable_positions(self, max_word_count):
+        """
+        Returns a list where entry i is True if words[i:] can be grouped
+        without using any dead span.
+        """
+        completable = [False] * (self.word_count + 1)
+        completable[self.word_count] = True
+
+        for start in range(self.word_count - 1, -1, -1):
+            completable[start] = any(
+                completable[end] and not self.is_dead(start, end)
+                for end in range(
+                    start + 1, min(start + max_word_count, self.word_count) + 1
+                )
+            )
+
+        return completable
+
+    def can_segment(self, max_word_count):
+        """
+        Returns True if at least one grouping of the sentence avoids every
+        dead span, i.e. the end of the sentence is reachable from the start.
+        """
+        reachable = [False] * (self.word_count + 1)
+        reachable[0] = True
+
+        for start in range(self.word_count):
+            if not reachable[start]:
+                continue
+            for end in range(
+                start + 1, min(start + max_word_count, self.word_count) + 1
+            ):
+                if not self.is_dead(start, end):
+                    reachable[end] = True
+
+        return reachable[self.word_count]
+
+
+def count_sentence_permutations(word_count, max_word_count, dead_spans=None):
+    # Cheap enough for the planner to call for every sentence and max_words
+    logger.debug(
         f"Counting permutations for {word_count} word(s) w/ max_word_count={max_word_count}"
     )
     # DP array to store number of permutations for 0 to n words
@@ -35,12 +85,112 @@ def count_sentence_permutations(word_count, max_word_count):
 
     for i in range(1, word_count + 1):
         for j in range(1, min(max_word_count, i) + 1):
+            if dead_spans is not None and dead_spans.is_dead(i - j, i):
+                continue
             dp[i] += dp[i - j]
 
     return dp[word_count]
 
 
-def generate_sentence_permutations_v3(sentence, max_word_count):
+class PhraseTable:
+    """
+    Interns every phrase (word span up to `max_word_count` words) of a
+    sentence once, giving each (start, end) span an integer phrase ID.
+    Groupings can then be handled as tuples of phrase IDs and only decoded
+    to strings for display and search.
+    """
+
+    def __init__(self, words, max_word_count):
+        self.words = words
+        self.max_word_count = max_word_count
+        self.spans = []  # phrase ID -> (start, end)
+        self.phrases = []  # phrase ID -> phrase text
+        self.ids = []  # ids[start][end - start - 1] -> phrase ID
+
+        for start in range(len(words)):
+            ids_from_start = []
+            for end in range(start + 1, min(start + max_word_count, len(words)) + 1):
+                ids_from_start.append(len(self.spans))
+                self.spans.append((start, end))
+                self.phrases.append(" ".join(words[start:end]))
+            self.ids.append(ids_from_start)
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def phrase_id(self, start, end):
+        return self.ids[start][end - start - 1]
+
+    def decode(self, phrase_ids):
+        """
+        Turns a tuple of phrase IDs back into a list of phrase strings.
+        """
+        return [self.phrases[phrase_id] for phrase_id in phrase_ids]
+
+    def dead_span_index(self, resolved):
+        """
+        Builds a DeadSpanIndex from `resolved`, a list indexed by phrase ID
+        whose entries are falsy for phrases without tracks.
+        """
+        dead_spans = DeadSpanIndex(len(self.words))
+        for phrase_id, result in enumerate(resolved):
+            if not result:
+                dead_spans.mark_dead(*self.spans[phrase_id])
+        return dead_spans
+
+
+def iter_encoded_permutations(phrase_table, dead_spans=None, prefix=()):
+    """
+    Yields the groupings of a sentence one at a time as tuples of phrase IDs,
+    in the same order as generate_sentence_permutations_v2, without ever
+    building the full list. Memory stays proportional to the sentence
+    length: the stack only holds the partial groupings on the current path
+    and their siblings.
+
+    With a `prefix` (the phrase IDs of a grouping's first phrases), only
+    the groupings starting with it are yielded.
+    """
+    total_number_of_words = len(phrase_table.words)
+    max_word_count = phrase_table.max_word_count
+
+    if dead_spans is None:
+        dead_spans = DeadSpanIndex(total_number_of_words)
+
+    # Never step into a branch that can't reach the end of the sentence
+    completable = dead_spans.completable_positions(max_word_count)
+    position = phrase_table.spans[prefix[-1]][1] if prefix else 0
+    if not completable[position]:
+        return
+
+    stack = [(position, tuple(prefix))]
+
+    while stack:
+        start, current_group = stack.pop()
+
+        if start == total_number_of_words:
+            yield current_group
+            continue
+
+        # Push longest groups first so the shortest one is popped first
+        ids_from_start = phrase_table.ids[start]
+        for length in range(len(ids_from_start), 0, -1):
+            end = start + length
+            if not completable[end] or dead_spans.is_dead(start, end):
+                continue
+            stack.append((end, current_group + (ids_from_start[length - 1],)))
+
+
+def iter_sentence_permutations(sentence, max_word_count, dead_spans=None):
+    """
+    Yields the groupings of `sentence` one at a time as lists of phrases.
+    See `iter_encoded_permutations`; each phrase string is only built once.
+    """
+    phrase_table = PhraseTable(sentence.split(), max_word_count)
+    for phrase_ids in iter_encoded_permutations(phrase_table, dead_spans=dead_spans):
+        yield phrase_table.decode(phrase_ids)
+
+
+def generate_sentence_permutations_v3(sentence, max_word_count, dead_spans=None):
     words = sentence.split()
     total_number_of_words = len(words)
 
@@ -55,6 +205,8 @@ def generate_sentence_permutations_v3(sentence, max_word_count):
         for end in range(
             start + 1, min(start + max_word_count + 1, total_number_of_words + 1)
         ):
+            if dead_spans is not None and dead_spans.is_dead(start, end):
+                continue
             # Current group: words[start:end]
             current_group = " ".join(words[start:end])
             # Combine with all groupings from dp[end]
@@ -65,7 +217,7 @@ def generate_sentence_permutations_v3(sentence, max_word_count):
     return dp[0]
 
 
-def generate_sentence_permutations_v2(sentence, max_word_count):
+def generate_sentence_permutations_v2(sentence, max_word_count, dead_spans=None):
     words = sentence.split()
     total_number_of_words = len(words)
     memo = {}
@@ -87,6 +239,8 @@ def generate_sentence_permutations_v2(sentence, max_word_count):
         for end in range(
             start + 1, min(start + max_word_count + 1, total_number_of_words + 1)
         ):
+            if dead_spans is not None and dead_spans.is_dead(start, end):
+                continue
             next_group = " ".join(words[start:end])
             # Recursively get permutations for the remaining words
             for suffix in backtrack(end):
@@ -99,7 +253,7 @@ def generate_sentence_permutations_v2(sentence, max_word_count):
     return backtrack(0)
 
 
-def generate_sentence_permutations(sentence, max_word_count):
+def generate_sentence_permutations(sentence, max_word_count, dead_spans=None):
     words = sentence.split()
     total_number_of_words = len(words)
     result = []
@@ -118,6 +272,8 @@ def generate_sentence_permutations(sentence, max_word_count):
         for end in range(
             start + 1, min(start + max_word_count + 1, total_number_of_words + 1)
         ):
+            if dead_spans is not None and dead_spans.is_dead(start, end):
+                continue
             # Create the next group by joining words from start to end
             next_group = " ".join(words[start:end])
             # Push the new state into the stack
@@ -0,0 +1,564 @@
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.lattice import (
+    count_lattice_segmentations,
+    iter_best_segmentations,
+    iter_lattice_segmentations,
+    lattice_from_phrase_table,
+)
+from app.permutations import (
+    PhraseTable,
+    count_sentence_permutations,
+    iter_encoded_permutations,
+    split_into_sentences,
+)
+from app.metrics import metrics
+from app.planner import plan_search
+from app.progress import ProgressReporter
+from app.ranking import LazyRankedList, TopCandidates, rank_playlists
+from app.scoring import get_scorer
+from app.sharding import SHARD_MIN_GROUPINGS, find_playlists_by_shards
+from app.spotify_api import SearchError, search_songs_concurrently
+from app.windows import (
+    WINDOW_TOP_K,
+    choose_window_cuts,
+    join_window_playlists,
+    solve_windows,
+    window_boundaries,
+    window_size,
+)
+
+logger = logging.getLogger(__name__)
+
+# How often (in groupings) the enumeration reports its position for
+# checkpointing
+CHECKPOINT_EVERY = 1000
+# Phrases searched between checks for an interrupted run
+SEARCH_BATCH_SIZE = 100
+
+# ANSI color codes (for terminal color). Adjust as needed.
+GREEN = "\033[92m"
+RED = "\033[91m"
+RESET = "\033[0m"
+
+
+class JobError(Exception):
+    """
+    Raised when a non-interactive job (batch line or API job) can't be
+    completed. Reported in the job's result instead of stopping the caller.
+    """
+
+
+def resolve_phrase_table(
+    phrase_table,
+    access_token,
+    max_results=20,
+    concurrency=4,
+    checkpoint=None,
+    show_progress=True,
+):
+    """
+    Searches every phrase in `phrase_table` (concurrently, skipping cached
+    ones) and returns a list of track lists indexed by phrase ID, showing
+    the search's progress as phrases are answered.
+    Raises SearchError if any search fails, rather than treating the phrase
+    as having no tracks.
+
+    With a SentenceCheckpoint, phrases are searched SEARCH_BATCH_SIZE at a
+    time, and the search stops between batches once the run is interrupted.
+    Finished searches are cached, so resuming doesn't repeat them.
+    """
+    phrases = phrase_table.phrases
+    batch_size = len(phrases) if checkpoint is None else SEARCH_BATCH_SIZE
+    resolved = []
+    progress = ProgressReporter(
+        len(phrases),
+        enabled=show_progress,
+        unit="phrases",
+        found_label="Phrases with tracks",
+    )
+    with progress:
+        for start in range(0, len(phrases), max(1, batch_size)):
+            if checkpoint is not None:
+                checkpoint.check_interrupted()
+            resolved.extend(
+                search_songs_concurrently(
+                    phrases[start : start + batch_size],
+                    access_token,
+                    max_results=max_results,
+                    concurrency=concurrency,
+                    progress=progress,
+                )
+            )
+    return resolved
+
+
+def _until_interrupted(items, checkpoint):
+    """
+    Yields every item of `items`, first checking whether the run of the
+    SentenceCheckpoint `checkpoint` (if any) was interrupted.
+    """
+    if checkpoint is None:
+        yield from items
+        return
+    for item in items:
+        checkpoint.check_interrupted()
+        yield item
+
+
+def build_track_list(all_tracks):
+    """
+    Builds a playlist candidate from a list of track lists (one per term),
+    picking the first (most popular) track for each term. The candidate
+    holds references to the shared Track records, not copies.
+    """
+    return [tracks_for_term[0] for tracks_for_term in all_tracks]
+
+
+def iter_matched_playlists(
+    encoded_permutations,
+    total_permutations,
+    resolved,
+    show_progress=True,
+    start=0,
+    on_position=None,
+):
+    """
+    Checks every grouping from the (possibly lazy) `encoded_permutations`,
+    as tuples of phrase IDs, against `resolved` (track lists indexed by
+    phrase ID). Yields a potential playlist (one track list) for every
+    grouping that fully matched.
+
+    The first `start` groupings are skipped without being checked. Every
+    CHECKPOINT_EVERY groupings, `on_position(position)` is called once the
+    first `position` groupings are checked and their matches consumed.
+    """
+    logger.info("Checking tracks for each permutation. This may take a while...")
+
+    i = start
+    encoded_permutations = itertools.islice(encoded_permutations, start, None)
+    with ProgressReporter(total_permutations, start, enabled=show_progress) as progress:
+        for i, phrase_ids in enumerate(encoded_permutations, start=start + 1):
+            progress.done = i
+            if on_position is not None and i % CHECKPOINT_EVERY == 0:
+                on_position(i - 1)
+
+            all_tracks = [resolved[phrase_id] for phrase_id in phrase_ids]
+            if not all(all_tracks):
+                continue
+
+            progress.found += 1
+            yield build_track_list(all_tracks)
+
+    metrics.increment("groupings_checked", i - start)
+
+
+def find_playlists_by_enumeration(
+    encoded_permutations,
+    total_permutations,
+    resolved,
+    scorer,
+    top_k=10,
+    show_progress=True,
+    checkpoint=None,
+):
+    """
+    Checks every grouping (see `iter_matched_playlists`) and returns the
+    `top_k` best-scoring potential playlists, best first. Only those are
+    kept in memory, not every match. A `top_k` of 0 keeps every match.
+
+    With a SentenceCheckpoint, continues from its saved position and
+    candidates, and periodically saves them.
+    """
+    top = TopCandidates(scorer, top_k)
+    start = 0
+
+    if checkpoint is not None:
+        start = checkpoint.position
+        top.extend(checkpoint.candidates)
+        if start:
+            logger.info(
+                f"Resuming at permutation {start:,} of {total_permutations:,} "
+                f"with {len(checkpoint.candidates)} saved potential playlist(s)."
+            )
+
+        def on_position(position):
+            checkpoint.save_progress(
+                position, lambda: [playlist for _, playlist in top.results()]
+            )
+
+    else:
+        on_position = None
+
+    top.extend(
+        iter_matched_playlists(
+            encoded_permutations,
+            total_permutations,
+            resolved,
+            show_progress,
+            start=start,
+            on_position=on_position,
+        )
+    )
+    return [playlist for _, playlist in top.results()]
+
+
+def find_playlists_by_lattice(
+    phrase_table, resolved, scorer, top_k=10, checkpoint=None
+):
+    """
+    Walks the phrase lattice of an already searched sentence and returns
+    the `top_k` best-scoring of its fully matched segmentations (every one,
+    best first, if `top_k` is 0). With a SentenceCheckpoint, stops once the
+    run is interrupted.
+    """
+    logger.info(
+        f"Walking the phrase lattice for {len(phrase_table.words)} word(s) "
+        f"(max_words={phrase_table.max_word_count})..."
+    )
+    lattice = lattice_from_phrase_table(phrase_table, resolved)
+    logger.info(
+        f"Lattice has {count_lattice_segmentations(lattice):,} valid segmentation(s) "
+        f"[{metrics.get('phrase_searches')} API searches]"
+    )
+
+    segmentations = (
+        build_track_list([tracks for _, tracks in segmentation])
+        for segmentation in _until_interrupted(
+            iter_lattice_segmentations(lattice), checkpoint
+        )
+    )
+    return [playlist for _, playlist in rank_playlists(segmentations, scorer, top_k)]
+
+
+def find_playlists_by_rank(phrase_table, resolved, scorer, top_k, checkpoint=None):
+    """
+    Extracts only the `top_k` highest-scoring segmentations from the phrase
+    lattice of an already searched sentence. With a SentenceCheckpoint,
+    stops once the run is interrupted.
+
+    With a `top_k` of 0, returns every segmentation as a LazyRankedList
+    instead, which only runs the search as far as it is read.
+    """
+    if not scorer.bounded:
+        # The best-first search needs additive bounds; otherwise every
+        # segmentation is scored, keeping only the top_k
+        return find_playlists_by_lattice(
+            phrase_table, resolved, scorer, top_k, checkpoint
+        )
+
+    logger.info(
+        f"Ranking the top {top_k or 'all'} playlist(s) by {scorer.name} "
+        f"for {len(phrase_table.words)} word(s)..."
+    )
+    lattice = lattice_from_phrase_table(phrase_table, resolved)
+
+    if not top_k:
+        return LazyRankedList(
+            tracks for _, tracks in iter_best_segmentations(lattice, scorer)
+        )
+
+    ranked = itertools.islice(iter_best_segmentations(lattice, scorer), top_k)
+    return [tracks for _, tracks in _until_interrupted(ranked, checkpoint)]
+
+
+def find_playlists_by_window(
+    phrase_table, resolved, scorer, top_k=10, processes=1, checkpoint=None
+):
+    """
+    Cuts a long, already searched sentence into overlapping windows (see
+    `app.windows`), finds each window's `top_k` best playlists on its own,
+    and joins them into the sentence's `top_k` best. A `top_k` of 0 keeps
+    WINDOW_TOP_K. With more than one of `processes`, the windows are solved
+    in that many worker processes. With a SentenceCheckpoint, stops between
+    windows once the run is interrupted.
+
+    Phrases crossing a cut are matched too, so for additive scorers this
+    finds the same playlists as the other strategies.
+    """
+    top_k = top_k or WINDOW_TOP_K
+    max_word_count = phrase_table.max_word_count
+    lattice = lattice_from_phrase_table(phrase_table, resolved)
+    cuts = choose_window_cuts(len(lattice), window_size(max_word_count))
+    boundaries = window_boundaries(lattice, cuts, max_word_count)
+    logger.info(
+        f"Solving {len(phrase_table.words)} word(s) as {len(cuts) - 1} window(s) "
+        f"(max_words={max_word_count})..."
+    )
+
+    window_playlists = solve_windows(
+        phrase_table, resolved, cuts, boundaries, scorer, top_k, processes, checkpoint
+    )
+    return join_window_playlists(window_playlists, scorer, top_k)
+
+
+def find_sentence_playlists(
+    sentence,
+    access_token,
+    max_words,
+    strategy="enumerate",
+    scorer=None,
+    top_k=10,
+    max_results=20,
+    concurrency=4,
+    show_progress=True,
+    checkpoint=None,
+    processes=1,
+):
+    """
+    Searches one sentence with the given strategy ("enumerate", "lattice",
+    "ranked" or "windowed") and returns its `top_k` best potential playlists
+    by `scorer` (popularity by default), best first. Returns an empty list,
+    without enumerating anything, if no grouping of the sentence can match.
+
+    With a SentenceCheckpoint, reuses whatever it saved (search results,
+    enumeration progress, or the final playlists) and saves progress to it.
+    Every strategy stops (raising SearchInterrupted) soon after the run is
+    interrupted.
+
+    With more than one of `processes`, enumerating a large sentence is split
+    over that many worker processes (see `find_playlists_by_shards`), and so
+    are the windows of a windowed one. Sharded progress is then only saved
+    once the whole sentence is done.
+    """
+    scorer = scorer or get_scorer("popularity")
+    metrics.increment("sentences")
+
+    if checkpoint is not None and checkpoint.playlists is not None:
+        logger.info(f'Using the saved playlists for "{sentence}".')
+        return checkpoint.playlists
+
+    playlists = _find_sentence_playlists(
+        sentence,
+        access_token,
+        max_words,
+        strategy,
+        scorer,
+        top_k,
+        max_results,
+        concurrency,
+        show_progress,
+        checkpoint,
+        processes,
+    )
+    # A lazy ranking can't be saved, but is quick to redo from the
+    # saved search results
+    if checkpoint is not None and isinstance(playlists, list):
+        checkpoint.save_done(playlists)
+    return playlists
+
+
+def _find_sentence_playlists(
+    sentence,
+    access_token,
+    max_words,
+    strategy,
+    scorer,
+    top_k,
+    max_results,
+    concurrency,
+    show_progress,
+    checkpoint,
+    processes,
+):
+    phrase_table = PhraseTable(sentence.split(), max_words)
+    if checkpoint is not None and checkpoint.resolved is not None:
+        resolved = checkpoint.resolved
+    else:
+        with metrics.timer("phrase_search_seconds"):
+            resolved = resolve_phrase_table(
+                phrase_table,
+                access_token,
+                max_results=max_results,
+                concurrency=concurrency,
+                checkpoint=checkpoint,
+                show_progress=show_progress,
+            )
+        if checkpoint is not None:
+            checkpoint.save_resolved(resolved)
+
+    # Give up on the sentence before enumerating anything if no grouping
+    # can avoid the phrases that have no tracks
+    dead_spans = phrase_table.dead_span_index(resolved)
+    if not dead_spans.can_segment(max_words):
+        metrics.increment("unmatched_sentences")
+        return []
+
+    with metrics.timer(f"{strategy}_seconds"):
+        if strategy == "lattice":
+            return find_playlists_by_lattice(
+                phrase_table, resolved, scorer, top_k, checkpoint
+            )
+
+        if strategy == "ranked":
+            return find_playlists_by_rank(
+                phrase_table, resolved, scorer, top_k, checkpoint
+            )
+
+        if strategy == "windowed":
+            return find_playlists_by_window(
+                phrase_table, resolved, scorer, top_k, processes, checkpoint
+            )
+
+        total_permutations = count_sentence_permutations(
+            len(phrase_table.words), max_words, dead_spans=dead_spans
+        )
+        logger.info(f"Found {total_permutations:,} permutations in total.")
+        if processes > 1 and total_permutations >= SHARD_MIN_GROUPINGS:
+            return find_playlists_by_shards(
+                phrase_table,
+                resolved,
+                dead_spans,
+                scorer,
+                top_k,
+                processes,
+                total_permutations,
+                show_progress,
+                checkpoint,
+            )
+        return find_playlists_by_enumeration(
+            iter_encoded_permutations(phrase_table, dead_spans=dead_spans),
+            total_permutations,
+            resolved,
+            scorer,
+            top_k=top_k,
+            show_progress=show_progress,
+            checkpoint=checkpoint,
+        )
+
+
+def find_all_sentence_playlists(
+    sentences,
+    access_token,
+    max_words,
+    sentence_concurrency=4,
+    checkpoint=None,
+    plans=None,
+    **options,
+):
+    """
+    Runs `find_sentence_playlists` for every sentence, up to
+    `sentence_concurrency` sentences at a time, and returns their potential
+    playlists in the same order as `sentences` (an empty list for each
+    sentence that can't be matched). `options` are passed through to
+    `find_sentence_playlists`.
+
+    Sentences share the search cache, so a phrase found in several of them
+    is only searched once. An unmatched sentence doesn't stop the others.
+
+    With a RunCheckpoint, each sentence saves its progress to it, and on
+    Ctrl-C every sentence saves and stops before KeyboardInterrupt is
+    re-raised. A failed search (SearchError) stops the run the same way,
+    so it can be resumed once Spotify answers again.
+
+    With `plans` (SentencePlans from `app.planner`, one per sentence), each
+    sentence uses its plan's strategy and max_words instead.
+    """
+    sentences = list(sentences)
+    results = [None] * len(sentences)
+
+    # Interleaved progress lines from several sentences would be unreadable
+    if len(sentences) > 1 and sentence_concurrency > 1:
+        options["show_progress"] = False
+
+    def find(index):
+        start = time.perf_counter()
+        sentence_checkpoint = None
+        if checkpoint is not None:
+            sentence_checkpoint = checkpoint.for_sentence(index, sentences[index])
+        sentence_options = options
+        sentence_max_words = max_words
+        if plans is not None:
+            sentence_options = dict(options, strategy=plans[index].strategy)
+            sentence_max_words = plans[index].max_words
+        playlists = find_sentence_playlists(
+            sentences[index],
+            access_token,
+            sentence_max_words,
+            checkpoint=sentence_checkpoint,
+            **sentence_options,
+        )
+        return index, playlists, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, sentence_concurrency)) as executor:
+        futures = [executor.submit(find, index) for index in range(len(sentences))]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                index, playlists, seconds = future.result()
+                results[index] = playlists
+                _log_sentence_done(sentences, index, playlists, seconds, done)
+        except (KeyboardInterrupt, SearchError):
+            # Running sentences stop at their next checkpoint; the executor
+            # waits for them before the error goes on
+            for future in futures:
+                future.cancel()
+            if checkpoint is not None:
+                logger.warning("Stopping, saving progress...")
+                checkpoint.interrupt()
+            raise
+
+    return results
+
+
+def _log_sentence_done(sentences, index, playlists, seconds, done):
+    color = GREEN
+    if isinstance(playlists, LazyRankedList):
+        # Counting them would rank every one
+        outcome = "potential playlists, ranked as they are viewed"
+    elif playlists:
+        outcome = f"{len(playlists):,} potential playlist(s)"
+    else:
+        color, outcome = RED, "no match"
+    logger.info(
+        f"{color}Sentence {index + 1}/{len(sentences)}{RESET} "
+        f'"{sentences[index]}": {outcome} in {seconds:.2f}s '
+        f"[{done}/{len(sentences)} sentences done]"
+    )
+
+
+def find_best_playlist(
+    search_string,
+    access_token,
+    max_words,
+    scorer,
+    max_results=20,
+    concurrency=4,
+    sentence_concurrency=4,
+):
+    """
+    Picks the best-scoring set of tracks for every sentence in
+    `search_string` and returns them as one playlist.
+    Raises JobError listing every sentence that can't be matched, or if
+    searching Spotify fails.
+
+    Each sentence's strategy is planned like the CLI's (see `plan_search`),
+    so long sentences with scorers the ranked search can't bound are
+    searched in windows instead of walking every segmentation.
+    """
+    sentences = split_into_sentences(search_string)
+    plans = plan_search(sentences, max_words, scorer, top_k=1, concurrency=concurrency)
+    try:
+        results = find_all_sentence_playlists(
+            sentences,
+            access_token,
+            max_words,
+            sentence_concurrency=sentence_concurrency,
+            plans=plans,
+            scorer=scorer,
+            top_k=1,
+            max_results=max_results,
+            concurrency=concurrency,
+            show_progress=False,
+        )
+    except SearchError as e:
+        raise JobError(str(e)) from e
+
+    unmatched = [sentence for sentence, best in zip(sentences, results) if not best]
+    if unmatched:
+        raise JobError(
+            "Unable to match " + ", ".join(f"'{sentence}'" for sentence in unmatched)
+        )
+    return [track for best in results for track in best[0]]
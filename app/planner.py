@@ -0,0 +1,256 @@
+"""
+Picks how to search each sentence before any searching starts, from the
+predicted size of the problem, and fits the run into optional budgets for
+Spotify searches, memory and time by lowering `max_words` where needed.
+"""
+
+import logging
+import math
+
+from app.lattice import iter_sentence_spans
+from app.normalize import canonical_phrase
+from app.permutations import count_sentence_permutations
+from app.ranking import RANK_CHUNK_SIZE
+from app.sharding import SHARD_MIN_GROUPINGS
+from app.windows import WINDOW_TOP_K, window_size
+
+logger = logging.getLogger(__name__)
+
+# Sentences with at most this many groupings are fully enumerated; larger
+# ones are searched through the phrase lattice, and ones longer than
+# RANKED_MAX_WORDS (or too large to walk every segmentation of) in windows
+ENUMERATE_MAX_GROUPINGS = 200_000
+RANKED_MAX_WORDS = 200
+
+# Rough costs, measured with the benchmark's fake Spotify server. They only
+# need to be right to within a small factor to pick a strategy.
+SECONDS_PER_SEARCH = 0.25  # one Spotify search round trip
+SECONDS_PER_GROUPING = 10e-6  # checking and scoring one grouping
+# The ranked search expands about top_k * phrases partial paths, each
+# costing time proportional to its length in words
+SECONDS_PER_RANKED_STEP = 50e-9
+# Joining windows scores top_k * top_k candidates per pair of ends joined,
+# about log2(windows) times over for each track
+SECONDS_PER_JOINED_TRACK = 100e-9
+# A kept candidate: its list, heap entry and one pointer per track
+BYTES_PER_CANDIDATE = 120
+BYTES_PER_CANDIDATE_TRACK = 8
+# How many playlists a lazily ranked result (--top-k 0) is costed for
+RANKED_PAGE_ESTIMATE = 10
+
+
+class Budget:
+    """
+    Limits for a whole run. Any limit left as None is not enforced.
+    """
+
+    def __init__(self, max_api_calls=None, max_memory_mb=None, max_seconds=None):
+        self.max_api_calls = max_api_calls
+        self.max_memory_mb = max_memory_mb
+        self.max_seconds = max_seconds
+
+    def exceeded(self, api_calls, memory_bytes, seconds):
+        """
+        Returns the names of the limits the predicted costs go over.
+        """
+        exceeded = []
+        if self.max_api_calls is not None and api_calls > self.max_api_calls:
+            exceeded.append("api_calls")
+        if (
+            self.max_memory_mb is not None
+            and memory_bytes > self.max_memory_mb * 1024 * 1024
+        ):
+            exceeded.append("memory")
+        if self.max_seconds is not None and seconds > self.max_seconds:
+            exceeded.append("seconds")
+        return exceeded
+
+
+class SentencePlan:
+    """
+    How one sentence will be searched, and its predicted costs: the
+    distinct phrases it searches, how many groupings it has, and the CPU
+    seconds and peak bytes its strategy should take.
+    """
+
+    def __init__(self, sentence, strategy, max_words, phrases, groupings):
+        self.sentence = sentence
+        self.strategy = strategy
+        self.max_words = max_words
+        self.phrases = phrases
+        self.groupings = groupings
+        self.seconds = 0.0
+        self.memory = 0
+
+    def describe(self):
+        return (
+            f"{self.strategy}, max_words={self.max_words}, "
+            f"{_format_count(self.groupings)} grouping(s), "
+            f"{len(self.phrases):,} phrase(s), ~{self.seconds:.1f}s of CPU"
+        )
+
+
+def plan_sentence(sentence, max_words, scorer, top_k, strategy=None, processes=1):
+    """
+    Predicts the cost of searching `sentence` and returns its SentencePlan.
+    With `strategy` None, picks one (see `choose_strategy`). Enumeration and
+    windows are split over `processes` worker processes when that is worth
+    it.
+    """
+    words = sentence.split()
+    spans = list(iter_sentence_spans(len(words), max_words))
+    phrases = {canonical_phrase(" ".join(words[start:end])) for start, end in spans}
+    groupings = count_sentence_permutations(len(words), max_words)
+    strategy = strategy or choose_strategy(len(words), groupings, scorer, processes)
+
+    plan = SentencePlan(sentence, strategy, max_words, phrases, groupings)
+    if strategy == "windowed":
+        top_k = top_k or WINDOW_TOP_K
+        window_words = window_size(max_words)
+        windows = -(-len(words) // window_words)
+        # Windows overlap by up to max_words - 1 words on each side, and are
+        # solved once for each of the up to max_words places they can start
+        # and end at
+        window = plan_sentence(
+            " ".join(words[: window_words + max_words - 1]),
+            max_words,
+            scorer,
+            top_k,
+            "ranked",
+        )
+        solves = windows * max_words * max_words
+        # Each pair joined also stitches up to max_words ** 3 pairs of ends
+        joined = top_k * top_k * max_words**3 * len(words) * math.log2(max(windows, 2))
+        # Windows are solved in worker processes, but joined in this one
+        plan.seconds = (
+            solves * window.seconds / processes + joined * SECONDS_PER_JOINED_TRACK
+        )
+        candidate_bytes = BYTES_PER_CANDIDATE + BYTES_PER_CANDIDATE_TRACK * len(words)
+        plan.memory = top_k * top_k * max_words**3 * candidate_bytes
+    elif strategy == "ranked" and scorer.bounded:
+        steps = (top_k or RANKED_PAGE_ESTIMATE) * len(spans)
+        plan.seconds = steps * len(words) * SECONDS_PER_RANKED_STEP
+        # The frontier holds partial paths of about half the sentence
+        plan.memory = steps * (
+            BYTES_PER_CANDIDATE + BYTES_PER_CANDIDATE_TRACK * len(words) // 2
+        )
+    else:
+        # Enumeration, or a walk of every lattice segmentation
+        kept = groupings if not top_k else min(top_k, groupings)
+        kept += min(RANK_CHUNK_SIZE, groupings)
+        plan.seconds = _scaled(groupings, SECONDS_PER_GROUPING)
+        if strategy == "enumerate" and groupings >= SHARD_MIN_GROUPINGS:
+            plan.seconds /= processes
+        plan.memory = _scaled(
+            kept, BYTES_PER_CANDIDATE + BYTES_PER_CANDIDATE_TRACK * len(words)
+        )
+
+    return plan
+
+
+def choose_strategy(word_count, groupings, scorer, processes=1):
+    """
+    Full enumeration for small sentences (larger ones too with more worker
+    `processes`); the ranked best-first lattice search for larger ones, if
+    the scorer allows it; windows for the longest ones, and for any too
+    large to enumerate otherwise.
+    """
+    if groupings <= ENUMERATE_MAX_GROUPINGS * processes:
+        return "enumerate"
+    if scorer.bounded and word_count <= RANKED_MAX_WORDS:
+        return "ranked"
+    return "windowed"
+
+
+def plan_search(
+    sentences,
+    max_words,
+    scorer,
+    top_k,
+    strategy=None,
+    budget=None,
+    concurrency=4,
+    processes=1,
+):
+    """
+    Plans every sentence (see `plan_sentence`) and returns their
+    SentencePlans. With a Budget, repeatedly lowers `max_words` for the
+    sentence costing the most of whatever is over budget, until the run
+    fits or every sentence is down to single words.
+    """
+    plans = [
+        plan_sentence(sentence, max_words, scorer, top_k, strategy, processes)
+        for sentence in sentences
+    ]
+    budget = budget or Budget()
+
+    while True:
+        api_calls, memory, seconds = estimate_run(plans, concurrency)
+        exceeded = budget.exceeded(api_calls, memory, seconds)
+        if not exceeded:
+            break
+
+        cost = {
+            "api_calls": lambda plan: len(plan.phrases),
+            "memory": lambda plan: plan.memory,
+            "seconds": lambda plan: (
+                plan.seconds
+                + len(plan.phrases) * SECONDS_PER_SEARCH / max(1, concurrency)
+            ),
+        }[exceeded[0]]
+        lowerable = [plan for plan in plans if plan.max_words > 1]
+        if not lowerable:
+            logger.warning(
+                f"The search is predicted to exceed its {', '.join(exceeded)} "
+                "budget even matching single words only; running it anyway."
+            )
+            break
+
+        index = plans.index(max(lowerable, key=cost))
+        plan = plans[index]
+        plans[index] = plan_sentence(
+            plan.sentence, plan.max_words - 1, scorer, top_k, strategy, processes
+        )
+        logger.info(
+            f"Lowered max_words to {plan.max_words - 1} for sentence {index + 1} "
+            f"to stay within the {exceeded[0]} budget."
+        )
+
+    api_calls, memory, seconds = estimate_run(plans, concurrency)
+    logger.info(
+        f"Planned {len(plans)} sentence(s): at most {api_calls:,} search(es), "
+        f"~{seconds:.1f}s and ~{memory / (1024 * 1024):.1f} MB predicted."
+    )
+    return plans
+
+
+def estimate_run(plans, concurrency=4):
+    """
+    Returns the predicted (API calls, peak bytes, seconds) of running all
+    of `plans`. Phrases shared between sentences are only searched once,
+    and cached or locally indexed phrases not at all, so the API calls are
+    an upper bound. Sentences share one interpreter, so their CPU seconds
+    add up.
+    """
+    phrases = set()
+    for plan in plans:
+        phrases |= plan.phrases
+    api_calls = len(phrases)
+    search_seconds = api_calls * SECONDS_PER_SEARCH / max(1, concurrency)
+    memory = sum(plan.memory for plan in plans)
+    seconds = search_seconds + sum(plan.seconds for plan in plans)
+    return api_calls, memory, seconds
+
+
+def _scaled(count, factor):
+    # Grouping counts of long sentences are too big to be floats
+    try:
+        return count * factor
+    except OverflowError:
+        return math.inf
+
+
+def _format_count(count):
+    if count < 10**15:
+        return f"{count:,}"
+    return f"~10^{len(str(count)) - 1}"
@@ -0,0 +1,183 @@
+"""
+A throttled progress display for long loops, such as searching every
+phrase of a sentence or checking millions of permutations. The loop itself only updates a counter; a background thread
+redraws the progress at a fixed rate.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often the progress line is redrawn on a terminal
+TTY_INTERVAL = 0.2  # seconds
+# How often a progress line is logged when output isn't a terminal (e.g.
+# when it is redirected to a file)
+LOG_INTERVAL = 10  # seconds
+
+# ANSI color codes (for terminal color). Adjust as needed.
+GREEN = "\033[92m"
+RED = "\033[91m"
+RESET = "\033[0m"
+CLEAR_LINE = "\033[K"
+
+
+class ProgressReporter:
+    """
+    Shows how far a loop over `total` items (`unit`, e.g. "permutations")
+    has got, how many it has found (counted as `found_label`), the items
+    per second, the share of phrase lookups answered without calling
+    Spotify, and an ETA.
+
+    The loop just sets `done` (and `found`) as it goes, which is as cheap
+    as incrementing a counter. On a terminal, the line is redrawn in place
+    every TTY_INTERVAL seconds; otherwise a log line is written every
+    LOG_INTERVAL seconds. A disabled reporter shows nothing.
+
+    Use it as a context manager, so the final line is drawn and the
+    background thread stopped however the loop ends.
+    """
+
+    def __init__(
+        self,
+        total,
+        done=0,
+        enabled=True,
+        stream=None,
+        interval=None,
+        unit="permutations",
+        found_label="Potential playlists found",
+    ):
+        self.total = total
+        self.done = done
+        self.found = 0
+        self.enabled = enabled
+        self.unit = unit
+        self.found_label = found_label
+        self.stream = stream or sys.stdout
+        self.is_tty = _is_tty(self.stream)
+        self.interval = interval or (TTY_INTERVAL if self.is_tty else LOG_INTERVAL)
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+        self._last = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._started = (now, self.done)
+        self._last = (now, self.done)
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops redrawing and draws the final progress.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._render(final=True)
+        if self.is_tty:
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._render()
+
+    def _render(self, final=False):
+        now = time.monotonic()
+        done = self.done
+
+        last_time, last_done = self._last
+        self._last = (now, done)
+        elapsed = now - last_time
+        rate = (done - last_done) / elapsed if elapsed > 0 else 0
+
+        # The ETA uses the average rate so far, which is steadier than the
+        # rate since the last redraw. So does the final line: the loop has
+        # finished by then, so the rate since the last redraw is about 0.
+        started_time, started_done = self._started
+        average_rate = (done - started_done) / max(now - started_time, 1e-9)
+        if final:
+            rate = average_rate
+        eta = None
+        if average_rate > 0:
+            eta = (self.total - done) / average_rate
+
+        line = format_progress(
+            done,
+            self.total,
+            self.found,
+            rate,
+            eta,
+            color=self.is_tty,
+            unit=self.unit,
+            found_label=self.found_label,
+        )
+        if self.is_tty:
+            self.stream.write(f"\r{line}{CLEAR_LINE}")
+            self.stream.flush()
+        else:
+            logger.info(line)
+
+
+def format_progress(
+    done,
+    total,
+    found,
+    rate,
+    eta,
+    color=False,
+    unit="permutations",
+    found_label="Potential playlists found",
+):
+    """
+    Returns the progress line shown by ProgressReporter.
+    """
+    label = "Progress:"
+    if color:
+        label = f"{GREEN if found else RED}{label}{RESET}"
+    pct_done = done / total * 100 if total else 100
+
+    hits = metrics.get("cache_hits") + metrics.get("catalog_hits")
+    lookups = hits + metrics.get("cache_misses")
+    hit_ratio = f"{hits / lookups:.0%}" if lookups else "-"
+
+    return (
+        f"{label} {done:,}/{total:,} ({pct_done:.2f}%) | "
+        f"{found_label}: {found:,} | {rate:,.0f} {unit}/s | "
+        f"cache hits {hit_ratio} | ETA {format_duration(eta)}"
+    )
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def _is_tty(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
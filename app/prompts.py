@@ -1,6 +1,10 @@
 import logging
+from typing import Callable, Optional, Sequence
+
 from InquirerPy import inquirer
 
+from app.ranking import LazyRankedList
+
 logger = logging.getLogger(__name__)
 
 GREEN = "\033[92m"
@@ -8,6 +12,17 @@ RED = "\033[91m"
 YELLOW = "\033[93m"
 RESET = "\033[0m"
 
+# Items shown per page by the paginated prompts
+PAGE_SIZE = 20
+
+# Choice values of the navigation entries, next to the (integer) item indexes
+PREVIOUS_PAGE = "previous_page"
+NEXT_PAGE = "next_page"
+JUMP_TO_PAGE = "jump_to_page"
+SEARCH = "search"
+CLEAR_SEARCH = "clear_search"
+EXIT = "exit"
+
 
 def yes_no_select(prompt: str) -> bool:
     """
@@ -25,11 +40,141 @@ def yes_no_select(prompt: str) -> bool:
     return choice
 
 
+def paginated_select(
+    message: str,
+    source: Sequence,
+    format_page: Callable[[list], list],
+    matches: Optional[Callable[[object, str], bool]] = None,
+    page_size: int = PAGE_SIZE,
+    exit_label: str = "Exit",
+) -> Optional[int]:
+    """
+    Lets the user pick an item from `source` one page at a time.
+    Returns the index of the chosen item in `source`, or None on exit.
+
+    Only the visible page is formatted (`format_page` gets a list of
+    (index, item) pairs and returns their labels), and a LazyRankedList
+    source is only read as far as the pages shown. With `matches(item,
+    query)`, the user can also search, which filters the source lazily.
+    """
+    if not isinstance(source, LazyRankedList):
+        source = LazyRankedList(source)
+
+    everything = LazyRankedList(enumerate(source))
+    view = everything
+    query = None
+    page = 0
+
+    while True:
+        start = page * page_size
+        items = view.page(start, page_size)
+        if not items and page > 0:
+            # Jumped past the end, show the last page instead. Reading the
+            # page already reached the end, so this ranks nothing more.
+            page = max(0, view.loaded - 1) // page_size
+            continue
+
+        has_next = view.has_more(start + page_size)
+        page_count = ""
+        if view.exhausted:
+            page_count = f" of {max(1, -(-view.loaded // page_size))}"
+        search_label = f' matching "{query}"' if query else ""
+
+        choices = [
+            {"name": label, "value": index}
+            for label, (index, _) in zip(format_page(items), items)
+        ]
+        if not items:
+            logger.info(f"Nothing found{search_label}.")
+        if page > 0:
+            choices.append({"name": "◂ Previous page", "value": PREVIOUS_PAGE})
+        if has_next:
+            choices.append({"name": "Next page ▸", "value": NEXT_PAGE})
+        if page > 0 or has_next:
+            choices.append({"name": "Jump to page...", "value": JUMP_TO_PAGE})
+        if matches is not None:
+            choices.append({"name": "Search...", "value": SEARCH})
+        if query:
+            choices.append({"name": "Clear search", "value": CLEAR_SEARCH})
+        choices.append({"name": exit_label, "value": EXIT})
+
+        choice = inquirer.select(
+            message=f"{message} (page {page + 1}{page_count}{search_label})",
+            choices=choices,
+            instruction="↑/↓ to navigate, Enter to select",
+        ).execute()
+
+        if choice == PREVIOUS_PAGE:
+            page -= 1
+        elif choice == NEXT_PAGE:
+            page += 1
+        elif choice == JUMP_TO_PAGE:
+            # Pages up to the chosen one are ranked as it's shown, not the
+            # whole source
+            page_number = inquirer.text(
+                message="Page number:",
+                validate=lambda text: text.isdigit() and int(text) >= 1,
+                invalid_message="Enter a page number (1 or more).",
+            ).execute()
+            page = int(page_number) - 1
+        elif choice == SEARCH:
+            query = inquirer.text(message="Search for:").execute().strip() or None
+            view = everything
+            if query:
+                view = LazyRankedList(
+                    pair for pair in everything if matches(pair[1], query)
+                )
+            page = 0
+        elif choice == CLEAR_SEARCH:
+            view, query, page = everything, None, 0
+        elif choice == EXIT:
+            return None
+        else:
+            return choice
+
+
+def playlist_matches(tracks: list, query: str) -> bool:
+    """
+    Returns True if any track name or artist contains `query` (ignoring case).
+    """
+    query = query.casefold()
+    return any(
+        query in track.name.casefold() or query in track.artist.casefold()
+        for track in tracks
+    )
+
+
+def choose_playlist(playlists: Sequence, scorer) -> Optional[int]:
+    """
+    Lets the user pick one of the (possibly lazy) ranked `playlists`,
+    showing each page with its scores. Returns its index, or None on exit.
+    """
+
+    def format_page(page):
+        labels = []
+        scores = scorer.score_many([playlist for _, playlist in page])
+        for (index, playlist), score in zip(page, scores):
+            preview = " / ".join(track.name for track in playlist[:3])
+            if len(playlist) > 3:
+                preview += " / ..."
+            labels.append(
+                f"Playlist #{index + 1} | Score={score:g} | "
+                f"{len(playlist)} track(s) | {preview}"
+            )
+        return labels
+
+    return paginated_select(
+        "Select the playlist you want to examine/create:",
+        playlists,
+        format_page,
+        matches=playlist_matches,
+        exit_label="Skip this sentence",
+    )
+
+
 def scrollable_playlist_view(tracks):
     """
-    Display a scrollable list of tracks (via InquirerPy).
-    If the playlist is longer than 100 tracks, we won't show it here
-    because we already handle that limit during creation.
+    Display a scrollable list of tracks (via InquirerPy), a page at a time.
     """
 
     if len(tracks) == 0:
@@ -41,21 +186,24 @@ def scrollable_playlist_view(tracks):
         logger.info("Track listing (<= 10 total):")
         for i, track in enumerate(tracks, start=1):
             logger.info(
-                f" {i}. {track['name']} by {track['artist']} (pop={track['popularity']})"
+                f" {i}. {track.name} by {track.artist} (pop={track.popularity})"
             )
         return
 
     # Otherwise, let's do a scrollable list with InquirerPy.
     logger.info(f"Playlist has {len(tracks)} tracks, showing a scrollable list:")
-    display_choices = [
-        f"{i}. ({track['name']}) by {track['artist']} (pop={track['popularity']})"
-        for i, track in enumerate(tracks, start=1)
-    ]
-    # The user doesn't actually select anything; we just let them scroll
-    # until they press Enter. We'll label them all as "choices" for display.
-    _ = inquirer.select(
-        message="Scroll through tracks. Press Enter to finish viewing:",
-        choices=display_choices,
-        instruction="↑/↓ to scroll, Enter to exit track view",
-        default=0,
-    ).execute()
+
+    def format_page(page):
+        return [
+            f"{index + 1}. ({track.name}) by {track.artist} (pop={track.popularity})"
+            for index, track in page
+        ]
+
+    # The user doesn't actually select anything; selecting any track (or
+    # "Done") ends the track view.
+    _ = paginated_select(
+        "Scroll through tracks. Press Enter to finish viewing",
+        tracks,
+        format_page,
+        exit_label="Done",
+    )
@@ -0,0 +1,211 @@
+import heapq
+import itertools
+from collections import defaultdict
+from operator import attrgetter
+
+# NumPy is optional: with it, candidates are scored in bulk as a matrix;
+# without it, the scorers fall back to scoring one playlist at a time.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Candidates are scored this many at a time, so a lazy stream of candidates
+# is never fully held in memory
+RANK_CHUNK_SIZE = 4096
+
+
+class CandidateMatrix:
+    """
+    A batch of candidate playlists as NumPy arrays, one row per candidate
+    and one column per position, padded to the longest candidate.
+
+    `popularity` holds each track's popularity (0 in padding) and `mask`
+    is True for real tracks, so scoring functions never touch the Track
+    objects. Copying the values out of the tracks is most of the cost, so
+    artists are only copied if a scorer asks for them.
+    """
+
+    def __init__(self, playlists):
+        self.playlists = playlists
+        self.lengths = np.fromiter(map(len, playlists), dtype=np.int64)
+        width = int(self.lengths.max()) if len(playlists) else 0
+        self.mask = np.arange(width) < self.lengths[:, None]
+        self.popularity = self._matrix(self._field("popularity"), 0)
+
+    def _field(self, name):
+        return map(attrgetter(name), itertools.chain.from_iterable(self.playlists))
+
+    def _matrix(self, values, padding):
+        matrix = np.full(self.mask.shape, padding, dtype=np.int64)
+        # Row-major boolean assignment fills each row left to right
+        matrix[self.mask] = np.fromiter(
+            values, dtype=np.int64, count=int(self.lengths.sum())
+        )
+        return matrix
+
+    def sum_popularity(self):
+        return self.popularity.sum(axis=1)
+
+    def min_popularity(self):
+        padding = np.iinfo(np.int64).max
+        lowest = np.where(self.mask, self.popularity, padding).min(
+            axis=1, initial=padding
+        )
+        return np.where(self.lengths > 0, lowest, 0)
+
+    def mean_popularity(self):
+        return self.sum_popularity() / np.maximum(self.lengths, 1)
+
+    def artist_repeats(self):
+        """
+        Number of tracks per candidate whose artist appeared earlier in it.
+        """
+        if self.mask.shape[1] == 0:
+            return np.zeros(len(self.lengths), dtype=np.int64)
+
+        # A new code for every artist seen for the first time
+        codes = defaultdict(itertools.count().__next__)
+        artists = self._matrix(map(codes.__getitem__, self._field("artist")), -1)
+        # Padding (-1) sorts first, so each distinct artist starts where a
+        # sorted row changes value
+        ordered = np.sort(artists, axis=1)
+        distinct = (ordered[:, 0] >= 0) + (
+            (ordered[:, 1:] != ordered[:, :-1]) & (ordered[:, 1:] >= 0)
+        ).sum(axis=1)
+        return self.lengths - distinct
+
+
+class TopCandidates:
+    """
+    Keeps the `top_n` best of the candidate playlists added to it, scoring
+    them in chunks with `scorer.score_many`. Ties keep the order in which
+    candidates were added. With `top_n` None (or 0) every candidate is kept.
+
+    Only a heap of the best `top_n` candidates so far (plus one unscored
+    chunk) is held in memory, and `results` can be read at any time.
+    """
+
+    def __init__(self, scorer, top_n=None, chunk_size=RANK_CHUNK_SIZE):
+        self.scorer = scorer
+        self.top_n = top_n
+        self.chunk_size = chunk_size
+        # Min-heap of (score, -position, playlist), so the root is the worst
+        # candidate kept, and of equal scores the one that came last
+        self._heap = []
+        self._pending = []
+        self._position = 0
+
+    def add(self, playlist):
+        self._pending.append(playlist)
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+
+    def extend(self, playlists):
+        for playlist in playlists:
+            self.add(playlist)
+
+    def results(self):
+        """
+        Returns the best candidates so far as (score, playlist) pairs,
+        best first.
+        """
+        self._flush()
+        entries = sorted(self._heap, key=lambda entry: entry[:2], reverse=True)
+        return [(score, playlist) for score, _, playlist in entries]
+
+    def _flush(self):
+        chunk, self._pending = self._pending, []
+        if not chunk:
+            return
+
+        top_n = self.top_n
+        scores = self.scorer.score_many(chunk)
+        indices = range(len(chunk))
+        if np is not None and isinstance(scores, np.ndarray):
+            if top_n and len(chunk) > top_n:
+                # Only the chunk's own top_n can make it into the heap
+                # (stable, so of equal scores the earliest are kept)
+                best = np.argsort(-scores, kind="stable")[:top_n]
+                indices = np.sort(best).tolist()
+            scores = scores.tolist()
+
+        heap = self._heap
+        for index in indices:
+            entry = (scores[index], -(self._position + index), chunk[index])
+            if not top_n or len(heap) < top_n:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+        self._position += len(chunk)
+
+
+def rank_playlists(playlists, scorer, top_n=None, chunk_size=RANK_CHUNK_SIZE):
+    """
+    Scores the (possibly lazy) `playlists` and returns the `top_n` best as
+    (score, playlist) pairs, best first (see TopCandidates).
+    """
+    top = TopCandidates(scorer, top_n, chunk_size)
+    top.extend(playlists)
+    return top.results()
+
+
+class LazyRankedList:
+    """
+    A read-only list over a (possibly huge) iterator of ranked candidates,
+    pulling items from it only as far as they are asked for.
+
+    Indexing and `page` only consume the iterator up to the requested item,
+    so a chooser can show the first page of a lazy ranking right away.
+    `len()` has to consume the rest of the iterator.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._items = []
+        self.exhausted = False
+
+    def _fill(self, count):
+        while len(self._items) < count and not self.exhausted:
+            try:
+                self._items.append(next(self._iterator))
+            except StopIteration:
+                self.exhausted = True
+
+    @property
+    def loaded(self):
+        """
+        The number of items pulled from the iterator so far.
+        """
+        return len(self._items)
+
+    def page(self, start, count):
+        """
+        Returns up to `count` items starting at index `start`.
+        """
+        self._fill(start + count)
+        return self._items[start : start + count]
+
+    def has_more(self, index):
+        """
+        Returns True if there is an item at `index`.
+        """
+        self._fill(index + 1)
+        return index < len(self._items)
+
+    def __getitem__(self, index):
+        self._fill(index + 1)
+        return self._items[index]
+
+    def __iter__(self):
+        index = 0
+        while self.has_more(index):
+            yield self._items[index]
+            index += 1
+
+    def __bool__(self):
+        return self.has_more(0)
+
+    def __len__(self):
+        self._fill(float("inf"))
+        return len(self._items)
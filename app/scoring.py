@@ -0,0 +1,131 @@
+from app.ranking import CandidateMatrix, np
+
+
+class PopularityScorer:
+    """
+    Scores a playlist by the sum of its tracks' popularity (the default).
+    """
+
+    name = "popularity"
+    bounded = True
+
+    def edge_weight(self, track):
+        return track.popularity
+
+    def score(self, tracks):
+        return sum(t.popularity for t in tracks)
+
+    def score_many(self, playlists):
+        if np is None:
+            return [self.score(tracks) for tracks in playlists]
+        return CandidateMatrix(playlists).sum_popularity()
+
+
+class MinPopularityScorer:
+    """
+    Scores a playlist by its least popular track, so no track is obscure.
+    """
+
+    name = "min-popularity"
+    bounded = False
+
+    def score(self, tracks):
+        return min((t.popularity for t in tracks), default=0)
+
+    def score_many(self, playlists):
+        if np is None:
+            return [self.score(tracks) for tracks in playlists]
+        return CandidateMatrix(playlists).min_popularity()
+
+
+class MeanPopularityScorer:
+    """
+    Scores a playlist by the mean popularity of its tracks, however many.
+    """
+
+    name = "mean-popularity"
+    bounded = False
+
+    def score(self, tracks):
+        return sum(t.popularity for t in tracks) / len(tracks) if tracks else 0
+
+    def score_many(self, playlists):
+        if np is None:
+            return [self.score(tracks) for tracks in playlists]
+        return CandidateMatrix(playlists).mean_popularity()
+
+
+class FewestTracksScorer:
+    """
+    Prefers playlists made of fewer (longer) phrases.
+    """
+
+    name = "fewest-tracks"
+    bounded = True
+
+    def edge_weight(self, track):
+        return -1
+
+    def score(self, tracks):
+        return -len(tracks)
+
+    def score_many(self, playlists):
+        if np is None:
+            return [self.score(tracks) for tracks in playlists]
+        return -np.fromiter(map(len, playlists), dtype=np.int64)
+
+
+class ArtistDiversityScorer:
+    """
+    Sum of popularity, minus a penalty for every track whose artist
+    already appears earlier in the playlist.
+    """
+
+    name = "artist-diversity"
+    bounded = True
+
+    def __init__(self, repeat_penalty=50):
+        self.repeat_penalty = repeat_penalty
+
+    def edge_weight(self, track):
+        # Upper bound on what a track can add: repeats only ever subtract
+        return track.popularity
+
+    def score(self, tracks):
+        repeats = len(tracks) - len({t.artist for t in tracks})
+        return sum(t.popularity for t in tracks) - self.repeat_penalty * repeats
+
+    def score_many(self, playlists):
+        if np is None:
+            return [self.score(tracks) for tracks in playlists]
+        matrix = CandidateMatrix(playlists)
+        return matrix.sum_popularity() - self.repeat_penalty * matrix.artist_repeats()
+
+
+SCORERS = {
+    scorer.name: scorer
+    for scorer in (
+        PopularityScorer,
+        MinPopularityScorer,
+        MeanPopularityScorer,
+        FewestTracksScorer,
+        ArtistDiversityScorer,
+    )
+}
+
+
+def get_scorer(name):
+    """
+    Returns a scorer instance by name (see SCORERS).
+
+    Every scorer has `score(tracks)`, the value shown and ranked on, and
+    `score_many(playlists)`, the same for a batch of candidates at once
+    (vectorized with NumPy where installed).
+
+    Scorers marked `bounded` also have `edge_weight(track)`, an additive
+    per-track weight such that the sum of edge weights over any remaining
+    tracks is never below what those tracks can add to `score`. The k-best
+    search relies on that to stay exact; other scorers are ranked by
+    scoring every candidate.
+    """
+    return SCORERS[name]()
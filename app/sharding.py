@@ -0,0 +1,192 @@
+"""
+Checks the groupings of a large sentence in several worker processes, so
+the CPU-bound enumeration isn't limited to one core by the GIL.
+
+The grouping space is split into shards by the groupings' first phrases
+(see `split_into_shards`). Each worker gets a read-only copy of the
+searched phrase table once, checks whole shards and sends back only its
+shard's best candidates, as track IDs, which are merged in the parent.
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app.metrics import metrics
+from app.permutations import iter_encoded_permutations
+from app.progress import ProgressReporter
+from app.ranking import TopCandidates
+
+logger = logging.getLogger(__name__)
+
+# Shards per worker process, so workers that finish early pick up more
+# and none sits idle at the end
+SHARDS_PER_PROCESS = 8
+# Smaller sentences aren't worth starting worker processes for
+SHARD_MIN_GROUPINGS = 200_000
+
+
+def resolve_processes(processes):
+    """
+    Returns the number of worker processes to use for `--processes`, where
+    0 means one per CPU core.
+    """
+    if processes == 0:
+        return os.cpu_count() or 1
+    return max(1, processes)
+
+
+def worker_context():
+    """
+    Returns the multiprocessing context to start worker processes with.
+    The searching process runs threads (sentences, progress), and forking
+    a multi-threaded process can deadlock the child, so workers are
+    started fresh from a fork server (or spawned, where there is none).
+    They get everything they need from their initializer's arguments.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def split_into_shards(phrase_table, dead_spans, shard_count):
+    """
+    Returns at least `shard_count` grouping prefixes (tuples of phrase IDs)
+    where possible, such that every grouping starts with exactly one of
+    them. The prefixes are in enumeration order, so enumerating each in
+    turn yields the groupings in the same order as
+    `iter_encoded_permutations`.
+    """
+    word_count = len(phrase_table.words)
+    max_word_count = phrase_table.max_word_count
+    completable = dead_spans.completable_positions(max_word_count)
+    if not completable[0]:
+        return []
+
+    def end_of(prefix):
+        return phrase_table.spans[prefix[-1]][1] if prefix else 0
+
+    prefixes = [()]
+    while len(prefixes) < shard_count:
+        expanded = []
+        for prefix in prefixes:
+            start = end_of(prefix)
+            if start == word_count:
+                # Already a whole grouping
+                expanded.append(prefix)
+                continue
+            for end in range(start + 1, min(start + max_word_count, word_count) + 1):
+                if completable[end] and not dead_spans.is_dead(start, end):
+                    expanded.append(prefix + (phrase_table.phrase_id(start, end),))
+
+        if len(expanded) == len(prefixes):
+            # Every prefix is a whole grouping; there is nothing left to split
+            break
+        prefixes = expanded
+
+    return prefixes
+
+
+def find_playlists_by_shards(
+    phrase_table,
+    resolved,
+    dead_spans,
+    scorer,
+    top_k=10,
+    processes=2,
+    total_permutations=0,
+    show_progress=True,
+    checkpoint=None,
+):
+    """
+    Checks every grouping like `find_playlists_by_enumeration`, split over
+    `processes` worker processes, and returns the same `top_k` best
+    potential playlists, best first (every match if `top_k` is 0).
+    Progress (out of `total_permutations`) advances as shards finish.
+
+    With a SentenceCheckpoint, raises SearchInterrupted as soon as a shard
+    finishes after the run is interrupted, without waiting for the rest.
+    """
+    prefixes = split_into_shards(
+        phrase_table, dead_spans, processes * SHARDS_PER_PROCESS
+    )
+    logger.info(
+        f"Checking permutations in {len(prefixes)} shard(s) "
+        f"across {processes} worker process(es)..."
+    )
+
+    progress = ProgressReporter(total_permutations, enabled=show_progress)
+    executor = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=worker_context(),
+        initializer=_init_worker,
+        initargs=(phrase_table, resolved, dead_spans, scorer, top_k),
+    )
+    try:
+        with progress:
+            shard_results = []
+            for checked, matched, results in executor.map(_check_shard, prefixes):
+                progress.done += checked
+                progress.found += matched
+                shard_results.append(results)
+                if checkpoint is not None:
+                    checkpoint.check_interrupted()
+    finally:
+        # Don't wait for queued shards if we're stopping early
+        executor.shutdown(cancel_futures=True)
+
+    metrics.increment("groupings_checked", progress.done)
+
+    # Of equal scores, the serial enumeration keeps the earliest grouping:
+    # shards are in enumeration order, and so are equal scores within one
+    merged = sorted(
+        (
+            (score, shard, rank, track_ids)
+            for shard, results in enumerate(shard_results)
+            for rank, (score, track_ids) in enumerate(results)
+        ),
+        key=lambda entry: (-entry[0], entry[1], entry[2]),
+    )
+    if top_k:
+        merged = merged[:top_k]
+
+    tracks_by_id = {track.id: track for tracks in resolved for track in tracks}
+    return [
+        [tracks_by_id[track_id] for track_id in track_ids]
+        for _, _, _, track_ids in merged
+    ]
+
+
+# The searched sentence, set once in each worker process by _init_worker
+_shard_state = None
+
+
+def _init_worker(phrase_table, resolved, dead_spans, scorer, top_k):
+    global _shard_state
+    _shard_state = (phrase_table, resolved, dead_spans, scorer, top_k)
+
+
+def _check_shard(prefix):
+    """
+    Checks every grouping starting with `prefix`. Returns how many were
+    checked, how many matched, and the shard's best candidates as
+    (score, track IDs) pairs, best first.
+    """
+    phrase_table, resolved, dead_spans, scorer, top_k = _shard_state
+    top = TopCandidates(scorer, top_k)
+    checked = 0
+    matched = 0
+    for phrase_ids in iter_encoded_permutations(phrase_table, dead_spans, prefix):
+        checked += 1
+        all_tracks = [resolved[phrase_id] for phrase_id in phrase_ids]
+        if all(all_tracks):
+            matched += 1
+            top.add([tracks[0] for tracks in all_tracks])
+
+    # Track IDs are much cheaper to send back than pickled tracks, and the
+    # parent maps them back to its own shared Track records
+    candidates = [
+        (score, [track.id for track in playlist]) for score, playlist in top.results()
+    ]
+    return checked, matched, candidates
@@ -1,95 +1,343 @@
 import logging
+import random
 import requests
 import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
+from app.auth import TokenManager, resolve_access_token
 from app.caching import song_search_cache
+from app.catalog_index import local_catalog
+from app.concurrency import RateLimitGate, SingleFlight
+from app.http_session import get_session
+from app.metrics import COUNT_BUCKETS, metrics
+from app.normalize import canonical_phrase
+from app.tracks import track_from_spotify
 
 logger = logging.getLogger(__name__)
 
+# Can be pointed at a stand-in server, e.g. for benchmarks
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+
 # We always use market="US" and limit_per_request=20
 DEFAULT_MARKET = "US"
 LIMIT_PER_REQUEST = 20
 MAX_TRACKS_PER_ADD = 100
+MAX_RETRIES = 5
+DEFAULT_RETRY_AFTER = 1
+BASE_BACKOFF = 0.5  # seconds
+MAX_BACKOFF = 30  # seconds
+REQUEST_TIMEOUT = 30  # seconds
+
+# Shared by every thread, so one 429 pauses all requests
+rate_limit_gate = RateLimitGate()
+_search_flight = SingleFlight()
+
+
+class SearchError(Exception):
+    """
+    Raised when a track search fails (after retries), as opposed to finding
+    no match. A failed search is never cached or treated as a dead phrase.
+    """
 
 
 def spotify_request(method="GET", url="", access_token="", params=None, json_data=None):
     """
     Makes a request to the Spotify API with the given method, URL,
-    token, params, and JSON data. Logs an error if non-2xx response.
-    """
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-    response = requests.request(
-        method=method, url=url, headers=headers, params=params, json=json_data
-    )
+    token, params, and JSON data. Logs an error and returns None if the
+    request failed or got a non-2xx response.
+
+    Requests go through the shared keep-alive session. When rate limited
+    (HTTP 429), every thread pauses for the Retry-After period and the
+    request is tried again. GET requests are also retried on connection
+    errors and 5xx responses, with jittered exponential backoff. Other
+    errors, and any request that may already have been applied, are not
+    retried.
+
+    `access_token` is either a token string or a TokenManager. With a
+    TokenManager, each attempt uses its current token, and a request
+    rejected with HTTP 401 is retried once with a refreshed token.
+    """
+    response = _send_request(method, url, access_token, params, json_data)
+    if response is None:
+        return None
 
     if not 200 <= response.status_code < 300:
-        logger.error(f"Spotify API Error: {response.status_code}, {response.json()}")
+        logger.error(f"Spotify API Error: {response.status_code}, {response.text}")
+        metrics.increment("http_errors")
         return None
 
     return response
 
 
+def _send_request(method, url, access_token, params=None, json_data=None):
+    """
+    Same as `spotify_request`, but returns the last response whatever its
+    status, or None (after logging) if no response was received.
+    """
+    refreshed_token = False
+
+    for attempt in range(MAX_RETRIES + 1):
+        is_last_attempt = attempt == MAX_RETRIES
+        rate_limit_gate.wait()
+        if attempt:
+            metrics.increment("http_retries")
+
+        token = resolve_access_token(access_token)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+
+        metrics.increment("http_requests")
+        try:
+            with metrics.timer("http_request_seconds"):
+                response = get_session().request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    params=params,
+                    json=json_data,
+                    timeout=REQUEST_TIMEOUT,
+                )
+        except requests.exceptions.RequestException as e:
+            if method != "GET" or is_last_attempt:
+                logger.error(f"Spotify API request failed: {e}")
+                metrics.increment("http_errors")
+                return None
+            delay = _backoff_delay(attempt)
+            logger.warning(
+                f"Spotify API request failed ({e}), retrying in {delay:.1f}s."
+            )
+            time.sleep(delay)
+            continue
+
+        if (
+            response.status_code == 401
+            and isinstance(access_token, TokenManager)
+            and not refreshed_token
+            and not is_last_attempt
+        ):
+            # Rejected before being processed, so safe to retry any method
+            logger.warning("Access token rejected by Spotify, refreshing it.")
+            refreshed_token = True
+            access_token.refresh(stale_token=token)
+            continue
+
+        if response.status_code == 429:
+            metrics.increment("http_429")
+
+        if response.status_code == 429 and not is_last_attempt:
+            # The request was not processed, so it is safe to retry any method
+            retry_after = _retry_after(response) or DEFAULT_RETRY_AFTER
+            logger.warning(f"Rate limited by Spotify, backing off for {retry_after}s.")
+            rate_limit_gate.back_off(retry_after)
+            continue
+
+        if response.status_code >= 500 and method == "GET" and not is_last_attempt:
+            delay = _retry_after(response) or _backoff_delay(attempt)
+            logger.warning(
+                f"Spotify API Error: {response.status_code}, retrying in {delay:.1f}s."
+            )
+            time.sleep(delay)
+            continue
+
+        break
+
+    return response
+
+
+def _retry_after(response):
+    """
+    Returns the Retry-After header in seconds, or None if missing or invalid.
+    """
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt):
+    # "Full jitter": a random delay up to an exponentially growing cap
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2**attempt))
+
+
 def search_song_by_name(song_name, access_token, max_results=20):
     """
     Searches Spotify for tracks with the exact `song_name` (in market=US).
     Returns a list of matching tracks sorted by popularity (descending).
-    Uses a simple cache to avoid repeated requests for the same name.
+    Uses the search cache to avoid repeated requests for the same name.
+
+    Names are compared in canonical form (see `canonical_phrase`), so
+    "Love", "love," and "LOVE!" share one search and one cache entry.
+    Names found in the local catalog index (if configured, and built for
+    our market) are never searched at all.
+
+    Raises SearchError if the search fails, so a failure is never mistaken
+    for a name without tracks.
     """
 
-    if song_name in song_search_cache:
+    indexed_tracks = local_catalog.get(song_name, DEFAULT_MARKET, max_results)
+    if indexed_tracks is not None:
+        metrics.increment("catalog_hits")
+        return indexed_tracks
+
+    cached_tracks = song_search_cache.get(song_name, DEFAULT_MARKET, max_results)
+    if cached_tracks is not None:
         logger.debug(f"Cache hit for: {song_name}")
-        return song_search_cache[song_name]
+        metrics.increment("cache_hits")
+        return cached_tracks
+
+    metrics.increment("cache_misses")
+    return _search_song_single_flight(song_name, access_token, max_results)
+
+
+def _search_song_single_flight(song_name, access_token, max_results):
+    # Concurrent searches for the same phrase share a single request
+    return _search_flight.do(
+        song_search_cache.make_key(song_name, DEFAULT_MARKET, max_results),
+        lambda: _search_song_unless_cached(song_name, access_token, max_results),
+    )
 
+
+def _search_song_unless_cached(song_name, access_token, max_results):
+    # Another caller (e.g. another sentence) may have finished the same
+    # search between our cache check and now
+    cached_tracks = song_search_cache.get(song_name, DEFAULT_MARKET, max_results)
+    if cached_tracks is not None:
+        return cached_tracks
+    return _search_song_uncached(song_name, access_token, max_results)
+
+
+def _search_song_uncached(song_name, access_token, max_results):
     logger.debug(f"Cache miss for: {song_name}")
+    metrics.increment("phrase_searches")
+
+    with metrics.timer("search_seconds"):
+        return _search_song_pages(song_name, access_token, max_results)
+
 
-    url = "https://api.spotify.com/v1/search"
+def _search_song_pages(song_name, access_token, max_results):
+    url = f"{SPOTIFY_API_URL}/search"
+    query = canonical_phrase(song_name)
     tracks = []
     offset = 0
+    pages = 0
+
+    if not query:
+        # Only punctuation, nothing to search for
+        return []
 
     while len(tracks) < max_results:
         params = {
-            "q": f'track:"{song_name}"',
+            "q": f'track:"{query}"',
             "type": "track",
             "market": DEFAULT_MARKET,
             "limit": LIMIT_PER_REQUEST,
             "offset": offset,
         }
 
+        pages += 1
         response = spotify_request("GET", url, access_token, params=params)
         if not response:
-            logger.warning(
-                "Stopping track search due to API error or non-2xx response."
-            )
-            break
+            # Not cached, and not an empty result either: either would make
+            # the phrase look like it has no match
+            metrics.increment("failed_searches")
+            raise SearchError(f"Track search for '{song_name}' failed.")
 
         results = response.json()
         items = results.get("tracks", {}).get("items", [])
-        tracks.extend(items)
+        # Only keep the fields we use, not the full track objects
+        tracks.extend(track_from_spotify(item) for item in items if item)
 
         if len(items) < LIMIT_PER_REQUEST:
             break
         offset += LIMIT_PER_REQUEST
 
+    metrics.observe("search_pages", pages, buckets=COUNT_BUCKETS)
+
     # Sort by popularity descending
-    tracks = sorted(
-        tracks[:max_results], key=lambda x: x.get("popularity", 0), reverse=True
-    )
-    # Filter to exact matches (case-insensitive)
-    filtered_tracks = [t for t in tracks if t["name"].lower() == song_name.lower()]
+    tracks = sorted(tracks[:max_results], key=lambda x: x.popularity, reverse=True)
+    # Filter to exact matches (in canonical form)
+    filtered_tracks = [t for t in tracks if canonical_phrase(t.name) == query]
 
     logger.debug(f"Found {len(filtered_tracks)} tracks matching '{song_name}' exactly.")
-    song_search_cache[song_name] = filtered_tracks
+    song_search_cache.set(song_name, DEFAULT_MARKET, max_results, filtered_tracks)
     return filtered_tracks
 
 
+def search_songs_concurrently(
+    song_names, access_token, max_results=20, concurrency=4, progress=None
+):
+    """
+    Searches every name in `song_names`, returning a list of track lists in
+    the same order. Names are answered from the local catalog index or the
+    cache where possible; all other names are collected up front and
+    searched using up to `concurrency` threads, each distinct name only once.
+    Raises SearchError if any search fails.
+
+    With a ProgressReporter `progress`, its `done` (and `found`, for names
+    with tracks) advances by every name as it is answered.
+    """
+    keys = [
+        song_search_cache.make_key(song_name, DEFAULT_MARKET, max_results)
+        for song_name in song_names
+    ]
+    names_per_key = Counter(keys)
+
+    def answered(key, tracks):
+        if progress is not None:
+            progress.done += names_per_key[key]
+            if tracks:
+                progress.found += names_per_key[key]
+
+    found = {}
+    pending = {}
+    indexed = 0
+    for song_name, key in zip(song_names, keys):
+        if key in found or key in pending:
+            continue
+        indexed_tracks = local_catalog.get(song_name, DEFAULT_MARKET, max_results)
+        if indexed_tracks is not None:
+            found[key] = indexed_tracks
+            indexed += 1
+            answered(key, indexed_tracks)
+            continue
+        cached_tracks = song_search_cache.get(song_name, DEFAULT_MARKET, max_results)
+        if cached_tracks is None:
+            pending[key] = song_name
+        else:
+            found[key] = cached_tracks
+            answered(key, cached_tracks)
+
+    metrics.increment("catalog_hits", indexed)
+    metrics.increment("cache_hits", len(found) - indexed)
+    metrics.increment("cache_misses", len(pending))
+
+    if pending:
+        logger.info(
+            f"Searching {len(pending)} uncached phrase(s) with concurrency={concurrency}..."
+        )
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            searched = executor.map(
+                lambda name: _search_song_single_flight(
+                    name, access_token, max_results
+                ),
+                pending.values(),
+            )
+            for key, tracks in zip(pending, searched):
+                found[key] = tracks
+                answered(key, tracks)
+
+    return [found[key] for key in keys]
+
+
 def get_user_id(access_token):
     """
     Retrieves the current user ID from the Spotify API.
     """
-    url = "https://api.spotify.com/v1/me"
+    url = f"{SPOTIFY_API_URL}/me"
     response = spotify_request("GET", url, access_token)
     if not response:
         logger.error("Unable to retrieve user ID. Exiting.")
@@ -99,14 +347,16 @@ def get_user_id(access_token):
     return user_id
 
 
-def create_playlist(access_token, playlist_name):
+def create_playlist(access_token, playlist_name, user_id=None):
     """
     Creates a new Spotify playlist.
     Returns the full JSON response from the playlist creation API call.
+    Pass `user_id` to skip looking up the current user again.
     """
 
-    user_id = get_user_id(access_token)
-    url = f"https://api.spotify.com/v1/users/{user_id}/playlists"
+    if user_id is None:
+        user_id = get_user_id(access_token)
+    url = f"{SPOTIFY_API_URL}/users/{user_id}/playlists"
 
     data = {"name": playlist_name, "public": False}
 
@@ -124,21 +374,94 @@ def create_playlist(access_token, playlist_name):
     return playlist_info
 
 
+def get_playlist_length(access_token, playlist_id):
+    """
+    Returns the number of tracks currently in the playlist, or None on error.
+    """
+    url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks"
+    params = {"fields": "total", "limit": 1}
+    response = spotify_request("GET", url, access_token, params=params)
+    if not response:
+        return None
+    return response.json().get("total")
+
+
 def add_tracks_to_playlist(access_token, playlist_id, tracks):
     """
-    Adds the list of tracks to the specified playlist by ID.
+    Adds the list of tracks to the specified playlist by ID, in batches of
+    MAX_TRACKS_PER_ADD. Each batch is inserted at an explicit position after
+    the playlist's current tracks, so the order is kept.
+
+    Adding tracks isn't idempotent, so a batch that failed with a 5xx or
+    connection error is only retried once the playlist's length shows it
+    wasn't added; if it was, we move on. Any other error, or not being able
+    to tell, stops without retrying.
+    Returns True if every track was added.
     """
-    if len(tracks) > MAX_TRACKS_PER_ADD:
-        logger.error(
-            f"This playlist has more than {MAX_TRACKS_PER_ADD} tracks, which is too many. Aborting."
-        )
-        sys.exit(1)
+    uris = [track.uri for track in tracks]
+
+    with metrics.timer("playlist_write_seconds"):
+        return _add_track_uris_to_playlist(access_token, playlist_id, uris)
 
-    logger.info(f"Adding {playlist_id}")
 
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    uris = [track["uri"] for track in tracks]
+def _add_track_uris_to_playlist(access_token, playlist_id, uris):
+    # Without the starting length we can still append in order, but can't
+    # tell whether a failed batch actually went through, so never retry
+    start_length = get_playlist_length(access_token, playlist_id)
 
     logger.info(f"Adding {len(uris)} tracks to playlist {playlist_id}...")
-    data = {"uris": uris}
-    spotify_request("POST", url, access_token, json_data=data)
+
+    for offset in range(0, len(uris), MAX_TRACKS_PER_ADD):
+        batch = uris[offset : offset + MAX_TRACKS_PER_ADD]
+        data = {"uris": batch}
+        if start_length is not None:
+            data["position"] = start_length + offset
+
+        if not _add_batch(access_token, playlist_id, data, start_length, offset):
+            logger.error(
+                f"Unable to add tracks {offset + 1}-{offset + len(batch)} "
+                f"to playlist {playlist_id}. Aborting."
+            )
+            return False
+
+        metrics.increment("tracks_added", len(batch))
+        logger.info(f"Added {offset + len(batch)}/{len(uris)} tracks.")
+
+    return True
+
+
+def _add_batch(access_token, playlist_id, data, start_length, offset):
+    """
+    POSTs one batch of track URIs. Returns True once the playlist has it.
+    """
+    url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks"
+    batch_size = len(data["uris"])
+
+    for attempt in range(MAX_RETRIES + 1):
+        # 429s are retried in here, as they were never processed
+        response = _send_request("POST", url, access_token, json_data=data)
+        if response is not None:
+            if 200 <= response.status_code < 300:
+                return True
+            logger.error(f"Spotify API Error: {response.status_code}, {response.text}")
+            metrics.increment("http_errors")
+            if response.status_code < 500:
+                # Retrying won't change the answer
+                return False
+
+        # A 5xx or a lost connection may or may not have added the batch
+        if start_length is None or attempt == MAX_RETRIES:
+            return False
+        length = get_playlist_length(access_token, playlist_id)
+        if length == start_length + offset + batch_size:
+            logger.info("Batch was added despite the error, continuing.")
+            return True
+        if length != start_length + offset:
+            # Can't tell whether it was added, and retrying could duplicate it
+            return False
+
+        delay = _backoff_delay(attempt)
+        logger.warning(f"Adding tracks failed, retrying in {delay:.1f}s.")
+        time.sleep(delay)
+
+    return False
@@ -0,0 +1,83 @@
+import threading
+import weakref
+
+
+class Track:
+    """
+    The handful of track fields we use, instead of the full Spotify track
+    object (album, images, available_markets, ...).
+    Use `intern_track` to build these so each track exists only once.
+    """
+
+    # __weakref__ lets the intern table drop Tracks nobody uses any more
+    __slots__ = ("id", "name", "popularity", "artist", "uri", "__weakref__")
+
+    def __init__(self, id, name, popularity, artist, uri):
+        self.id = id
+        self.name = name
+        self.popularity = popularity
+        self.artist = artist
+        self.uri = uri
+
+    def __repr__(self):
+        return f"Track({self.name!r} by {self.artist!r}, pop={self.popularity})"
+
+    def to_dict(self):
+        """
+        JSON-friendly form used in batch and API job results.
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "artist": self.artist,
+            "popularity": self.popularity,
+            "uri": self.uri,
+        }
+
+    def to_row(self):
+        """
+        Compact, JSON-serializable form used by the persistent cache.
+        """
+        return [self.id, self.name, self.popularity, self.artist, self.uri]
+
+
+# The Tracks in use, by Spotify ID. Entries go away with the last reference
+# to their Track (e.g. when the search cache evicts it), so long-running
+# servers don't keep every track they have ever seen.
+_interned_tracks = weakref.WeakValueDictionary()
+_interned_tracks_lock = threading.Lock()
+
+
+def intern_track(id, name, popularity, artist, uri):
+    """
+    Returns the shared Track for this ID, creating it on first use.
+    If the track's fields changed (e.g. its popularity), a new Track
+    replaces the shared one; Tracks already handed out keep their values.
+    """
+    with _interned_tracks_lock:
+        track = _interned_tracks.get(id)
+        row = [id, name, popularity, artist, uri]
+        if track is None or track.to_row() != row:
+            track = Track(id, name, popularity, artist, uri)
+            _interned_tracks[id] = track
+        return track
+
+
+def track_from_spotify(item):
+    """
+    Builds (or reuses) a Track from a full Spotify track object.
+    """
+    return intern_track(
+        item["id"],
+        item["name"],
+        item.get("popularity", 0),
+        item["artists"][0]["name"] if item.get("artists") else "Unknown",
+        item["uri"],
+    )
+
+
+def track_from_row(row):
+    """
+    Builds (or reuses) a Track from its `Track.to_row` form.
+    """
+    return intern_track(*row)
@@ -0,0 +1,264 @@
+"""
+Windowed segmentation for paragraph-length sentences: the sentence is cut
+into windows of a dozen or so words (see `window_size`), each window's
+best groupings are found on their own, and the windows' results are
+joined back together.
+
+The cost grows with the number of windows, i.e. linearly in the number of
+words, instead of with the (exponential) number of groupings. Solving a
+window is CPU-bound, so with several processes the windows are solved in
+worker processes rather than threads.
+
+Neighbouring windows overlap by up to max_word_count - 1 words, so phrases
+crossing a cut are still matched. Each window is solved once for every
+place it can start and end at near its cuts: where the phrase holding the
+word at the cut starts. The joined windows are stitched together where one
+ends and the next starts, so every grouping of the sentence is covered.
+"""
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from app.lattice import (
+    iter_best_segmentations,
+    iter_lattice_segmentations,
+    lattice_from_phrase_table,
+)
+from app.permutations import PhraseTable, count_sentence_permutations
+from app.ranking import rank_playlists
+from app.sharding import worker_context
+
+# Windows are sized to have at most this many groupings each, overlaps
+# included, so every window is quick to solve exhaustively whatever the
+# scorer
+WINDOW_MAX_GROUPINGS = 20_000
+WINDOW_MAX_WORDS = 48
+# Candidates kept per window (and for the whole sentence) with --top-k 0,
+# as joining every window's every candidate would be exponential again
+WINDOW_TOP_K = 20
+
+
+def window_size(max_word_count):
+    """
+    Returns the most words between two cuts such that a window, with its
+    overlaps of max_word_count - 1 words on both sides, stays within
+    WINDOW_MAX_GROUPINGS groupings (and at least `max_word_count`).
+    """
+    overlap = max_word_count - 1
+    words = max_word_count
+    while (
+        words < WINDOW_MAX_WORDS
+        and count_sentence_permutations(words + 1 + overlap, max_word_count)
+        <= WINDOW_MAX_GROUPINGS
+    ):
+        words += 1
+    return words
+
+
+def choose_window_cuts(word_count, window_words):
+    """
+    Returns the positions to cut a sentence of `word_count` words at, every
+    `window_words` words, starting with 0 and ending with the word count.
+    """
+    return list(range(0, word_count, window_words)) + [word_count]
+
+
+def window_boundaries(edges, cuts, max_word_count):
+    """
+    Returns, for each of `cuts`, the positions a grouping can switch from
+    one window to the next at: the possible starts of the phrase holding
+    the word at the cut. Only positions some full grouping of the pruned
+    lattice `edges` passes through are kept.
+    """
+    word_count = len(edges)
+    on_path = [False] * (word_count + 1)
+    on_path[0] = True
+    for start in range(word_count):
+        if on_path[start]:
+            for end, _, _ in edges[start]:
+                on_path[end] = True
+
+    boundaries = []
+    for cut in cuts:
+        if cut in (0, word_count):
+            positions = [cut]
+        else:
+            positions = range(max(0, cut - max_word_count + 1), cut + 1)
+        # Once pruned, a position has edges only if it can reach the end
+        boundaries.append(
+            [
+                position
+                for position in positions
+                if on_path[position] and (position == word_count or edges[position])
+            ]
+        )
+    return boundaries
+
+
+def window_phrase_table(phrase_table, resolved, start, end, cut=None):
+    """
+    Returns the PhraseTable of words[start:end] and its slice of `resolved`
+    (track lists indexed by the new table's phrase IDs).
+
+    With a `cut`, the first phrase must hold the word at the cut, i.e. end
+    after it, so each grouping is only found from one of a cut's
+    boundaries.
+    """
+    table = PhraseTable(phrase_table.words[start:end], phrase_table.max_word_count)
+    table_resolved = [
+        (
+            []
+            if cut is not None and span_start == 0 and start + span_end <= cut
+            else resolved[phrase_table.phrase_id(start + span_start, start + span_end)]
+        )
+        for span_start, span_end in table.spans
+    ]
+    return table, table_resolved
+
+
+def solve_windows(
+    phrase_table,
+    resolved,
+    cuts,
+    boundaries,
+    scorer,
+    top_k,
+    processes=1,
+    checkpoint=None,
+):
+    """
+    Solves every window between two neighbouring `cuts`, once for each pair
+    of its `boundaries` (see `window_boundaries`). Returns, in sentence
+    order, a dict per window mapping (start, end) to the `top_k` best
+    playlists of words[start:end]. With more than one of `processes`, the
+    windows are solved in that many worker processes.
+
+    With a SentenceCheckpoint, raises SearchInterrupted between windows
+    once the run is interrupted, without waiting for the rest.
+    """
+    pieces = [
+        (index, start, end)
+        for index, (starts, ends) in enumerate(zip(boundaries, boundaries[1:]))
+        for start in starts
+        for end in ends
+    ]
+    windows = [
+        window_phrase_table(phrase_table, resolved, start, end, cuts[index] or None)
+        for index, start, end in pieces
+    ]
+    window_playlists = [{} for _ in boundaries[1:]]
+
+    if processes <= 1 or len(windows) <= 1:
+        for (index, start, end), (table, table_resolved) in zip(pieces, windows):
+            if checkpoint is not None:
+                checkpoint.check_interrupted()
+            window_playlists[index][start, end] = find_window_playlists(
+                table, table_resolved, scorer, top_k
+            )
+        return window_playlists
+
+    executor = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=worker_context(),
+        initializer=_init_worker,
+        initargs=(scorer, top_k),
+    )
+    try:
+        window_track_ids = []
+        for track_ids in executor.map(_solve_window, windows):
+            if checkpoint is not None:
+                checkpoint.check_interrupted()
+            window_track_ids.append(track_ids)
+    finally:
+        # Don't wait for queued windows if we're stopping early
+        executor.shutdown(cancel_futures=True)
+
+    tracks_by_id = {track.id: track for tracks in resolved for track in tracks}
+    for (index, start, end), playlists in zip(pieces, window_track_ids):
+        window_playlists[index][start, end] = [
+            [tracks_by_id[track_id] for track_id in track_ids]
+            for track_ids in playlists
+        ]
+    return window_playlists
+
+
+def find_window_playlists(phrase_table, resolved, scorer, top_k):
+    """
+    Returns the `top_k` best playlists of one window. Windows are small, so
+    they are walked directly, without the per-sentence logging of the
+    other strategies.
+    """
+    lattice = lattice_from_phrase_table(phrase_table, resolved)
+    if scorer.bounded:
+        ranked = itertools.islice(iter_best_segmentations(lattice, scorer), top_k)
+        return [tracks for _, tracks in ranked]
+
+    segmentations = (
+        [tracks[0] for _, tracks in segmentation]
+        for segmentation in iter_lattice_segmentations(lattice)
+    )
+    return [playlist for _, playlist in rank_playlists(segmentations, scorer, top_k)]
+
+
+# The scorer and top_k, set once in each worker process by _init_worker
+_window_state = None
+
+
+def _init_worker(scorer, top_k):
+    global _window_state
+    _window_state = (scorer, top_k)
+
+
+def _solve_window(window):
+    # Track IDs are much cheaper to send back than pickled tracks, and the
+    # parent maps them back to its own shared Track records
+    scorer, top_k = _window_state
+    table, table_resolved = window
+    playlists = find_window_playlists(table, table_resolved, scorer, top_k)
+    return [[track.id for track in playlist] for playlist in playlists]
+
+
+def join_window_playlists(window_playlists, scorer, top_k):
+    """
+    Joins each window's best playlists (dicts from `solve_windows`, in
+    sentence order) into the `top_k` best playlists for the whole sentence.
+    Neighbouring windows are only joined where one ends and the next
+    starts.
+
+    Neighbouring windows are joined in pairs, then pairs of pairs and so on,
+    so each track is only copied about log2(windows) times. This is exact
+    for additive scorers (such as popularity), whose best joined playlists
+    are always made of each side's best ones, and a close approximation for
+    the others.
+    """
+    while len(window_playlists) > 1:
+        pairs = zip(window_playlists[::2], window_playlists[1::2])
+        joined = [_join_pair(heads, tails, scorer, top_k) for heads, tails in pairs]
+        if len(window_playlists) % 2:
+            joined.append(window_playlists[-1])
+        window_playlists = joined
+    if not window_playlists:
+        return []
+    # Only the piece from the first word to the last is left, if any
+    return next(iter(window_playlists[0].values()), [])
+
+
+def _join_pair(heads, tails, scorer, top_k):
+    # (start, end) -> pairs of (head, tail) playlists meeting in the middle
+    pairs = {}
+    for (start, middle), head_playlists in heads.items():
+        for (tail_start, end), tail_playlists in tails.items():
+            if tail_start == middle:
+                pairs.setdefault((start, end), []).append(
+                    itertools.product(head_playlists, tail_playlists)
+                )
+
+    joined = {}
+    for span, products in pairs.items():
+        candidates = (
+            head + tail for head, tail in itertools.chain.from_iterable(products)
+        )
+        ranked = rank_playlists(candidates, scorer, top_k)
+        if ranked:
+            joined[span] = [playlist for _, playlist in ranked]
+    return joined
@@ -0,0 +1,221 @@
+"""
+A local stand-in for the parts of the Spotify Web API that Spotty uses,
+serving a synthetic, seeded track catalog so benchmarks never touch
+api.spotify.com.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VOCABULARY = (
+    "i you we they love heart night day time light dark fire rain sun moon "
+    "star sky blue red gold dream home road way long lost found run back "
+    "down up away again forever never always tonight tomorrow yesterday "
+    "my your our this that the a in on of to for with me be go come stay "
+    "feel know want need good bad one little world life baby girl boy "
+    "summer winter city river ocean wild young free alone together"
+).split()
+
+
+def build_catalog(seed=0, multi_word_titles=3000, dead_word_ratio=0.05):
+    """
+    Builds a deterministic catalog as a dict of normalized title -> list of
+    Spotify-style track objects. Most single words have tracks; a random
+    selection of 2-4 word phrases do too.
+    """
+    rng = random.Random(seed)
+    titles = set()
+
+    for word in VOCABULARY:
+        if rng.random() >= dead_word_ratio:
+            titles.add(word)
+
+    while len(titles) < len(VOCABULARY) + multi_word_titles:
+        length = rng.randint(2, 4)
+        titles.add(" ".join(rng.choice(VOCABULARY) for _ in range(length)))
+
+    catalog = {}
+    track_number = 0
+    for title in sorted(titles):
+        tracks = []
+        for _ in range(rng.randint(1, 4)):
+            track_number += 1
+            track_id = f"track{track_number:07d}"
+            tracks.append(
+                {
+                    "id": track_id,
+                    "name": title.title(),
+                    "popularity": rng.randint(0, 100),
+                    "artists": [{"name": f"Artist {rng.randint(1, 500)}"}],
+                    "uri": f"spotify:track:{track_id}",
+                }
+            )
+        catalog[title] = tracks
+
+    return catalog
+
+
+def build_corpus(lengths, seed=0):
+    """
+    Returns one sentence per word count in `lengths`, drawn from VOCABULARY.
+    """
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(n)) for n in lengths]
+
+
+class FakeSpotifyServer:
+    """
+    Serves /v1/search, /v1/me, playlist creation and playlist tracks from a
+    synthetic catalog, on a background thread.
+
+    :param latency: Seconds to sleep before answering each request.
+    :param rate_limit_every: Answer every Nth request with HTTP 429 (0 = never).
+    :param retry_after: Retry-After value (seconds) sent with each 429.
+    """
+
+    def __init__(self, catalog, latency=0.0, rate_limit_every=0, retry_after=0.05):
+        self.catalog = catalog
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self.playlists = {}
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _should_rate_limit(self):
+        with self._lock:
+            self._request_count += 1
+            return (
+                self.rate_limit_every
+                and self._request_count % self.rate_limit_every == 0
+            )
+
+    def _search(self, query, limit, offset):
+        match = re.fullmatch(r'track:"(.*)"', query)
+        phrase = " ".join((match.group(1) if match else query).lower().split())
+
+        # Like the real search, also return non-exact matches that the
+        # client has to filter out
+        items = list(self.catalog.get(phrase, []))
+        for suffix in (" remix", " live"):
+            items.extend(self.catalog.get(phrase + suffix, []))
+
+        return {
+            "tracks": {"items": items[offset : offset + limit], "total": len(items)}
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                payload = json.dumps(body or {}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _handle(self, method):
+                parsed = urllib.parse.urlparse(self.path)
+                path = parsed.path
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if server._should_rate_limit():
+                    with server._lock:
+                        server.requests["429"] += 1
+                    self._send(429, {}, {"Retry-After": str(server.retry_after)})
+                    return
+
+                if method == "GET" and path == "/v1/search":
+                    endpoint = "search"
+                    status, response = 200, server._search(
+                        query.get("q", ""),
+                        int(query.get("limit", 20)),
+                        int(query.get("offset", 0)),
+                    )
+                elif method == "GET" and path == "/v1/me":
+                    endpoint = "me"
+                    status, response = 200, {"id": "benchmark-user"}
+                elif method == "POST" and re.fullmatch(
+                    r"/v1/users/[^/]+/playlists", path
+                ):
+                    endpoint = "create_playlist"
+                    with server._lock:
+                        playlist_id = f"playlist{len(server.playlists) + 1}"
+                        server.playlists[playlist_id] = []
+                    status, response = 201, {
+                        "id": playlist_id,
+                        "name": body.get("name"),
+                    }
+                elif re.fullmatch(r"/v1/playlists/[^/]+/tracks", path):
+                    playlist_id = path.split("/")[3]
+                    with server._lock:
+                        tracks = server.playlists.setdefault(playlist_id, [])
+                        if method == "GET":
+                            endpoint = "get_playlist_tracks"
+                            status, response = 200, {"total": len(tracks)}
+                        else:
+                            endpoint = "add_tracks"
+                            position = body.get("position", len(tracks))
+                            tracks[position:position] = body.get("uris", [])
+                            status, response = 201, {"snapshot_id": str(len(tracks))}
+                else:
+                    endpoint = "not_found"
+                    status, response = 404, {"error": {"status": 404}}
+
+                with server._lock:
+                    server.requests[endpoint] += 1
+                self._send(status, response)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        return Handler
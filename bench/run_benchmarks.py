@@ -0,0 +1,319 @@
+"""
+Offline benchmarks for Spotty, run against a local fake Spotify API.
+
+    python -m bench.run_benchmarks --output bench_output.json
+
+The pipeline benchmarks run the CLI entry point (`app.main.main`) end to
+end, with planning, caching, checkpointing and the playlist write, and the
+interactive prompts answered automatically.
+
+Every input (catalog, corpus) is generated from --seed, so call and cache
+counts are reproducible; timings are wall-clock seconds.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from app import main as cli_main
+from app import spotify_api
+from app.caching import song_search_cache
+from app.metrics import metrics
+from app.permutations import (
+    PhraseTable,
+    generate_sentence_permutations,
+    generate_sentence_permutations_v2,
+    generate_sentence_permutations_v3,
+    iter_encoded_permutations,
+    iter_sentence_permutations,
+)
+from app.ranking import LazyRankedList
+from app.tracks import track_from_spotify
+from bench.fake_spotify import FakeSpotifyServer, build_catalog, build_corpus
+
+GENERATORS = {
+    "generate_sentence_permutations": generate_sentence_permutations,
+    "generate_sentence_permutations_v2": generate_sentence_permutations_v2,
+    "generate_sentence_permutations_v3": generate_sentence_permutations_v3,
+    "iter_sentence_permutations": lambda sentence, max_words: list(
+        iter_sentence_permutations(sentence, max_words)
+    ),
+    "iter_encoded_permutations": lambda sentence, max_words: list(
+        iter_encoded_permutations(PhraseTable(sentence.split(), max_words))
+    ),
+}
+
+
+def timed(fn, repeat=1):
+    """
+    Runs `fn` `repeat` times and returns (best time in seconds, last result).
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # The generators print progress; keep it out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_generators(corpus, max_words, repeat):
+    results = []
+    for sentence in corpus:
+        for name, generator in GENERATORS.items():
+            seconds, groupings = timed(
+                lambda: generator(sentence, max_words), repeat=repeat
+            )
+            results.append(
+                {
+                    "generator": name,
+                    "words": len(sentence.split()),
+                    "max_words": max_words,
+                    "groupings": len(groupings),
+                    "seconds": seconds,
+                }
+            )
+    return results
+
+
+def run_cli(search_string, strategy, args, checkpoint_path):
+    """
+    Runs `app.main.main` for `search_string` like a user would, picking the
+    best playlist of every sentence and creating it. Returns how many
+    candidate playlists were offered (lazily ranked ones count as one).
+    """
+    candidates = 0
+
+    def choose_playlist(playlists, scorer):
+        nonlocal candidates
+        if isinstance(playlists, LazyRankedList):
+            # Counting them would rank every one
+            candidates += 1
+        else:
+            candidates += len(playlists)
+        return 0
+
+    argv = [
+        "app.main",
+        "--access-token",
+        "benchmark-token",
+        "--playlist-name",
+        "Benchmark",
+        "--search-string",
+        search_string,
+        "--strategy",
+        strategy,
+        "--max-words",
+        str(args.max_words),
+        "--top-k",
+        str(args.top_k),
+        "--concurrency",
+        str(args.concurrency),
+        "--no-persistent-cache",
+        "--checkpoint-path",
+        checkpoint_path,
+        # The previous sentence's checkpoint is still there if it matched
+        # nothing
+        "--force",
+    ]
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(sys, "argv", argv))
+        stack.enter_context(
+            mock.patch.object(cli_main, "choose_playlist", choose_playlist)
+        )
+        stack.enter_context(
+            mock.patch.object(cli_main, "yes_no_select", lambda prompt: True)
+        )
+        stack.enter_context(
+            mock.patch.object(cli_main, "scrollable_playlist_view", lambda tracks: None)
+        )
+        # One summary per run would pile up until the benchmark exits
+        stack.enter_context(
+            mock.patch.object(cli_main.atexit, "register", lambda *a, **k: None)
+        )
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        try:
+            cli_main.main()
+        except SystemExit as e:
+            # main() exits early when nothing matched, or on errors
+            if e.code:
+                raise
+    return candidates
+
+
+def run_pipeline_pass(server, corpus, strategy, args):
+    """
+    Runs the CLI once for every sentence of `corpus` and returns its
+    measurements.
+    """
+    server.reset_counters()
+    metrics.reset()
+
+    candidates = 0
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_path = os.path.join(directory, "checkpoint.json.gz")
+        for sentence in corpus:
+            candidates += run_cli(sentence, strategy, args, checkpoint_path)
+    seconds = time.perf_counter() - start
+
+    summary = metrics.summary()
+    return {
+        "seconds": seconds,
+        "candidates": candidates,
+        "unmatched_sentences": metrics.get("unmatched_sentences"),
+        "cache_hit_ratio": summary["cache_hit_ratio"],
+        "api_calls": dict(server.requests),
+        "metrics": summary,
+    }
+
+
+def bench_pipeline(server, corpus, args):
+    results = []
+    for strategy in args.strategies:
+        for sentence in corpus:
+            words = len(sentence.split())
+            if strategy == "enumerate" and words > args.max_enumerate_words:
+                continue
+
+            song_search_cache.clear()
+
+            for cache_state in ("cold", "warm"):
+                result = run_pipeline_pass(server, [sentence], strategy, args)
+                results.append(
+                    {"strategy": strategy, "words": words, "cache": cache_state}
+                    | result
+                )
+    return results
+
+
+def bench_playlist_writes(server, track_counts):
+    results = []
+    tracks = [
+        track
+        for tracks in server.catalog.values()
+        for track in (track_from_spotify(item) for item in tracks)
+    ]
+
+    for count in track_counts:
+        server.reset_counters()
+        start = time.perf_counter()
+        playlist = spotify_api.create_playlist("benchmark-token", "Benchmark")
+        added = spotify_api.add_tracks_to_playlist(
+            "benchmark-token", playlist["id"], tracks[:count]
+        )
+        results.append(
+            {
+                "tracks": count,
+                "added": added,
+                "seconds": time.perf_counter() - start,
+                "api_calls": dict(server.requests),
+            }
+        )
+    return results
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Run Spotty's benchmarks against a local fake Spotify API."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-words", type=int, default=4)
+    parser.add_argument(
+        "--generator-lengths",
+        type=int,
+        nargs="+",
+        default=[4, 8, 12, 16, 20],
+        help="Sentence lengths (in words) for the permutation generator benchmarks.",
+    )
+    parser.add_argument(
+        "--pipeline-lengths",
+        type=int,
+        nargs="+",
+        default=[4, 8, 16, 32, 64],
+        help="Sentence lengths (in words) for the search pipeline benchmarks.",
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=["auto", "enumerate", "lattice", "ranked", "windowed"],
+        default=["auto", "enumerate", "lattice", "ranked", "windowed"],
+        help="Strategies to run the CLI with ('auto' lets the planner pick).",
+    )
+    parser.add_argument(
+        "--max-enumerate-words",
+        type=int,
+        default=20,
+        help="Skip the enumerate strategy for longer sentences.",
+    )
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--playlist-sizes", type=int, nargs="+", default=[50, 100, 250, 1000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds the fake API waits before each response.",
+    )
+    parser.add_argument(
+        "--rate-limit-every",
+        type=int,
+        default=0,
+        help="Make the fake API answer every Nth request with HTTP 429.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="-",
+        help="Where to write the JSON results (default: stdout).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    # app.main sets up INFO logging when imported
+    logging.getLogger().setLevel(logging.ERROR)
+
+    catalog = build_catalog(seed=args.seed)
+    results = {
+        "config": vars(args) | {"python": platform.python_version()},
+        "generators": bench_generators(
+            build_corpus(args.generator_lengths, seed=args.seed),
+            args.max_words,
+            args.repeat,
+        ),
+    }
+
+    with FakeSpotifyServer(
+        catalog, latency=args.latency, rate_limit_every=args.rate_limit_every
+    ) as server:
+        spotify_api.SPOTIFY_API_URL = server.url
+        results["pipeline"] = bench_pipeline(
+            server, build_corpus(args.pipeline_lengths, seed=args.seed), args
+        )
+        results["playlist_writes"] = bench_playlist_writes(server, args.playlist_sizes)
+
+    output = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()